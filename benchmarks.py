@@ -0,0 +1,322 @@
+"""Not for assignment: timing the Blocky implementation"""
+
+import gc
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import bitboard
+import block
+import game_stats
+import renderer
+from board_corpus import BoardCorpus
+from goal import BlobGoal, PerimeterGoal
+from renderer import COLOUR_LIST, HeadlessRenderer
+
+
+def _gc_timed(run: Callable[[], None]) -> Dict[str, float]:
+    """Run <run>, and return the total seconds it took and the seconds
+    spent in the garbage collector while it ran.
+    """
+    gc_time = [0.0]
+    started = [0.0]
+
+    def on_gc(phase: str, _info: Dict[str, int]) -> None:
+        if phase == 'start':
+            started[0] = time.perf_counter()
+        else:
+            gc_time[0] += time.perf_counter() - started[0]
+
+    gc.collect()
+    gc.callbacks.append(on_gc)
+    start = time.perf_counter()
+    try:
+        run()
+    finally:
+        total = time.perf_counter() - start
+        gc.callbacks.remove(on_gc)
+    return {'seconds': total, 'gc_seconds': gc_time[0]}
+
+
+def smash_benchmark(num_games: int = 20, num_turns: int = 50) \
+        -> Dict[str, Dict[str, float]]:
+    """Play <num_games> smash-heavy games between four random players on
+    depth 5 boards, once without and once with the free list of discarded
+    Blocks, and return the allocation counts and timings of each run.
+    """
+    results = {}
+    default_limit = block.FREE_LIST_LIMIT
+    for name, limit in [('no free list', 0), ('free list', default_limit)]:
+        block.FREE_LIST_LIMIT = limit
+        block._FREE_BLOCKS.clear()
+        block.reset_allocation_counts()
+
+        def play() -> None:
+            random.seed(148)
+            for _ in range(num_games):
+                game = game_stats.Game(5, 0, 4, [],
+                                       renderer=HeadlessRenderer(4))
+                game.run_game(num_turns)
+
+        results[name] = _gc_timed(play)
+        results[name].update(block.ALLOCATION_COUNTS)
+    block.FREE_LIST_LIMIT = default_limit
+    return results
+
+
+def goal_corpus_benchmark(path: str) -> Dict[str, float]:
+    """Score every board of the corpus at <path> with a BlobGoal and a
+    PerimeterGoal of every colour, and return the seconds spent scoring
+    with each goal type.
+
+    Each goal type gets its own copy of each board, decoded from the corpus
+    before timing starts, so decoding is not counted, neither goal type
+    benefits from work cached by the other, and the corpus is never held
+    in memory.
+    """
+    seconds = {'BlobGoal': 0.0, 'PerimeterGoal': 0.0}
+    with BoardCorpus(path) as corpus:
+        for i in range(len(corpus)):
+            for goal_type in (BlobGoal, PerimeterGoal):
+                board = corpus.board(i)
+                goals = [goal_type(colour) for colour in COLOUR_LIST]
+                start = time.perf_counter()
+                for goal in goals:
+                    goal.score(board)
+                seconds[goal_type.__name__] += time.perf_counter() - start
+    return seconds
+
+
+def bitboard_benchmark(depths: Iterable[int] = range(3, 9),
+                       num_boards: int = 5) \
+        -> Dict[int, Dict[str, Optional[float]]]:
+    """Score <num_boards> random boards of each max_depth in <depths> with a
+    BlobGoal and a PerimeterGoal of every colour, with Goal.score, with
+    Goal.score_bitboard and, for BlobGoal, with BlobGoal.score_grid, and
+    return the mean seconds per board for each.
+
+    Every board is generated afresh for each way of scoring it, so none
+    reuses work cached by another.  The bitboard timings include building
+    the Bitboard from the tree, and the score timings include any
+    flattening the goal does.  BlobGoal.score_grid recurses once per cell
+    of a blob, and is reported as None at depths where that overflows the
+    stack.
+    """
+    scorers = {
+        BlobGoal: {'': BlobGoal.score, ' grid': BlobGoal.score_grid},
+        PerimeterGoal: {'': PerimeterGoal.score}
+    }
+    results = {}
+    for depth in depths:
+        timings = {}
+        for goal_type, ways in scorers.items():
+            goals = [goal_type(colour) for colour in COLOUR_LIST]
+            name = goal_type.__name__
+            bitboard_time = 0.0
+            expected = []
+            for i in range(num_boards):
+                board = block.random_board(depth, block.game_rng(depth, i))
+                start = time.perf_counter()
+                expected.append([
+                    goal.score_bitboard(bitboard.from_block(board))
+                    for goal in goals])
+                bitboard_time += time.perf_counter() - start
+            timings[name + ' bitboard'] = bitboard_time / num_boards
+            for suffix, score in ways.items():
+                seconds = 0.0
+                for i in range(num_boards):
+                    board = block.random_board(depth,
+                                               block.game_rng(depth, i))
+                    start = time.perf_counter()
+                    try:
+                        scores = [score(goal, board) for goal in goals]
+                    except RecursionError:
+                        seconds = None
+                        break
+                    seconds += time.perf_counter() - start
+                    assert scores == expected[i]
+                timings[name + suffix] = None if seconds is None \
+                    else seconds / num_boards
+        results[depth] = timings
+    return results
+
+
+def flatten_benchmark(depths: Iterable[int] = (5, 7), num_moves: int = 200) \
+        -> Dict[int, Dict[str, float]]:
+    """Make <num_moves> random rotations and swaps on a random board of each
+    max_depth in <depths>, flattening the board after each, and return the
+    mean seconds per flatten: looking up each unit cell with
+    get_colour_at_square, joining rasters without the raster cache, and
+    joining rasters with it.
+    """
+    results = {}
+    default_limit = block.RASTER_CACHE_LIMIT
+    for depth in depths:
+        timings = {}
+        for name, limit in [('per cell', None), ('no cache', 0),
+                            ('cache', default_limit)]:
+            block.RASTER_CACHE_LIMIT = 0 if limit is None else limit
+            board = block.random_board(depth, block.game_rng(depth, 0))
+            board.update_block_locations((0, 0), 500)
+            blocks = list(board.block_index().internal_blocks())
+            rng = random.Random(depth)
+            width = 2**depth
+            board.flatten()
+            seconds = 0.0
+            for _ in range(num_moves):
+                target = rng.choice(blocks)
+                if rng.random() < 0.5:
+                    target.rotate(rng.choice([1, 3]))
+                else:
+                    target.swap(rng.randint(0, 1))
+                start = time.perf_counter()
+                if limit is None:
+                    [[board.get_colour_at_square(x, y) for y in range(width)]
+                     for x in range(width)]
+                else:
+                    board.flatten()
+                seconds += time.perf_counter() - start
+            timings[name] = seconds / num_moves
+        results[depth] = timings
+    block.RASTER_CACHE_LIMIT = default_limit
+    return results
+
+
+def renderer_setup_benchmark(runs: int = 20, num_players: int = 4) \
+        -> Dict[str, float]:
+    """Create <runs> Renderers for <num_players> players one after another,
+    as back-to-back games do, and return the median seconds each took to
+    set up, with the shared pygame resources cleared before each one and
+    with them kept.
+
+    This opens a pygame window; set SDL_VIDEODRIVER=dummy to run it without
+    a display.
+    """
+    results = {}
+    for name, clear in [('uncached', True), ('cached', False)]:
+        times = []
+        for _ in range(runs):
+            if clear:
+                renderer.clear_resource_cache()
+            start = time.perf_counter()
+            renderer.Renderer(num_players)
+            times.append(time.perf_counter() - start)
+        results[name] = statistics.median(times)
+    return results
+
+
+def delta_benchmark(num_games: int = 10, num_turns: int = 25,
+                    max_depth: int = 5,
+                    smart_players: Optional[List[int]] = None
+                    ) -> Dict[str, Dict[str, float]]:
+    """Play <num_games> games between four players on boards of
+    <max_depth>, streaming each board to a copy after every move, once as
+    deltas and once as full snapshots from encode_board.  <smart_players>
+    holds the difficulty of each SmartPlayer, and random players make up
+    the rest; by default every player is random.
+
+    Return, for each stream, the bytes sent per move, the seconds spent
+    encoding on the sending side, and the moves per second the receiving
+    side can apply (with apply_delta, or by decoding each snapshot).
+    """
+    if smart_players is None:
+        smart_players = []
+    sent = {'deltas': 0, 'snapshots': 0}
+    encoding = {'deltas': 0.0, 'snapshots': 0.0}
+    applying = {'deltas': 0.0, 'snapshots': 0.0}
+    moves = 0
+    for i in range(num_games):
+        random.seed(i)
+        game = game_stats.Game(max_depth, 0, 4 - len(smart_players),
+                               smart_players,
+                               rng=block.game_rng(max_depth, i),
+                               renderer=HeadlessRenderer(4))
+        copy = block.decode_board(block.encode_board(game.board))
+        game.board.record_deltas()
+        delta_stream = []
+        snapshot_stream = []
+        for turn in range(num_turns * len(game.players)):
+            start = time.perf_counter()
+            game.players[turn % len(game.players)].make_move(game.board)
+            delta_stream.append(game.board.take_deltas())
+            encoding['deltas'] += time.perf_counter() - start
+            start = time.perf_counter()
+            snapshot_stream.append(block.encode_board(game.board))
+            encoding['snapshots'] += time.perf_counter() - start
+        moves += len(delta_stream)
+        sent['deltas'] += sum(len(delta) for deltas in delta_stream
+                              for delta in deltas)
+        sent['snapshots'] += sum(len(data) for data in snapshot_stream)
+
+        start = time.perf_counter()
+        for deltas in delta_stream:
+            for delta in deltas:
+                block.apply_delta(copy, delta)
+        applying['deltas'] += time.perf_counter() - start
+        start = time.perf_counter()
+        for data in snapshot_stream:
+            block.decode_board(data)
+        applying['snapshots'] += time.perf_counter() - start
+        assert block.encode_board(copy) == snapshot_stream[-1]
+    # The delta encoding time includes playing the moves, so subtract the
+    # time the same games take to play without recording deltas.
+    encoding['deltas'] -= _play_time(num_games, num_turns, max_depth,
+                                    smart_players)
+    return {stream: {'bytes_per_move': sent[stream] / moves,
+                     'encode_seconds': max(encoding[stream], 0.0),
+                     'moves_per_second': moves / applying[stream]}
+            for stream in sent}
+
+
+def _play_time(num_games: int, num_turns: int, max_depth: int,
+               smart_players: List[int]) -> float:
+    """Return the seconds spent making moves in the games played by
+    delta_benchmark, without recording deltas.
+    """
+    seconds = 0.0
+    for i in range(num_games):
+        random.seed(i)
+        game = game_stats.Game(max_depth, 0, 4 - len(smart_players),
+                               smart_players,
+                               rng=block.game_rng(max_depth, i),
+                               renderer=HeadlessRenderer(4))
+        for turn in range(num_turns * len(game.players)):
+            start = time.perf_counter()
+            game.players[turn % len(game.players)].make_move(game.board)
+            seconds += time.perf_counter() - start
+    return seconds
+
+
+def startup_benchmark(module: str = 'stats_collection',
+                      runs: int = 15) -> Tuple[float, bool]:
+    """Import <module> in <runs> fresh Python processes, and return the
+    median seconds each process took to start and import it, and whether
+    the import loaded pygame.
+    """
+    code = f"import sys, {module}; print('pygame' in sys.modules)"
+    times = []
+    loaded = False
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code],
+                                capture_output=True, text=True, check=True)
+        times.append(time.perf_counter() - start)
+        loaded = result.stdout.split()[-1] == 'True'
+    return statistics.median(times), loaded
+
+
+if __name__ == '__main__':
+    print('import stats_collection', startup_benchmark())
+    for run, result in smash_benchmark().items():
+        print(run, result)
+    for depth, result in bitboard_benchmark().items():
+        print('max_depth', depth, result)
+    for depth, result in flatten_benchmark().items():
+        print('flatten at max_depth', depth, result)
+    for stream, result in delta_benchmark().items():
+        print('streaming', stream, result)
+    for stream, result in delta_benchmark(smart_players=[5, 5]).items():
+        print('streaming with smart players', stream, result)
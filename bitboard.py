@@ -0,0 +1,151 @@
+"""Not for assignment: scoring goals on bitboards
+
+A Bitboard stores a board as one arbitrary-precision int per colour in
+COLOUR_LIST, with bit y * width + x set iff the unit cell in column x and
+row y has that colour.  Perimeter scores are then popcounts of the border
+bits, and blobs grow by shifting and masking whole rows of cells at once
+instead of visiting cells one at a time.
+"""
+
+from typing import Dict, List, Tuple
+from block import Block
+from renderer import COLOUR_LIST
+
+
+class Bitboard:
+    """A board stored as one bit plane per colour.
+
+    === Public Attributes ===
+    width:
+        The number of unit cells across the board.
+    planes:
+        The bit plane of each colour in COLOUR_LIST, in the same order.
+    """
+    width: int
+    planes: List[int]
+    # === Private Attributes ===
+    # _masks:
+    #     The masks of the board's top row, bottom row, left column and
+    #     right column, in that order, and of every cell but those in the
+    #     left column and every cell but those in the right column
+
+    def __init__(self, width: int, planes: List[int]) -> None:
+        """Initialize this bitboard <width> cells across, with the given bit
+        <planes>.
+        """
+        self.width = width
+        self.planes = planes
+        self._masks = _edge_masks(width)
+
+    def plane(self, colour: Tuple[int, int, int]) -> int:
+        """Return the bit plane of <colour>, which is 0 if <colour> is not in
+        COLOUR_LIST.
+        """
+        if colour not in _COLOUR_INDEX:
+            return 0
+        return self.planes[_COLOUR_INDEX[colour]]
+
+    def perimeter(self, colour: Tuple[int, int, int]) -> int:
+        """Return the number of unit cells of <colour> on the perimeter of
+        the board, with corner cells counted twice, as PerimeterGoal does.
+        """
+        plane = self.plane(colour)
+        top, bottom, left, right = self._masks[:4]
+        return (plane & top).bit_count() + (plane & bottom).bit_count() + \
+            (plane & left).bit_count() + (plane & right).bit_count()
+
+    def largest_blob(self, colour: Tuple[int, int, int]) -> int:
+        """Return the number of unit cells in the largest connected blob of
+        <colour>, as BlobGoal does.
+
+        Each blob is grown from one of its cells by repeatedly adding the
+        neighbours of the whole blob at once, until it stops growing.
+        """
+        plane = self.plane(colour)
+        not_left, not_right = self._masks[4:]
+        width = self.width
+        largest = 0
+        remaining = plane
+        while remaining:
+            blob = remaining & -remaining
+            while True:
+                grown = (blob | ((blob << 1) & not_left) |
+                         ((blob >> 1) & not_right) |
+                         (blob << width) | (blob >> width)) & plane
+                if grown == blob:
+                    break
+                blob = grown
+            largest = max(largest, blob.bit_count())
+            remaining &= ~blob
+        return largest
+
+
+def from_grid(grid: List[List[Tuple[int, int, int]]]) -> Bitboard:
+    """Return the Bitboard of a board flattened by Block.flatten.
+    """
+    width = len(grid)
+    planes = [0] * len(COLOUR_LIST)
+    for x in range(width):
+        for y in range(width):
+            colour = grid[x][y]
+            if colour in _COLOUR_INDEX:
+                planes[_COLOUR_INDEX[colour]] |= 1 << (y * width + x)
+    return Bitboard(width, planes)
+
+
+def from_block(board: Block) -> Bitboard:
+    """Return the Bitboard of <board>, built straight from its tree with one
+    mask per undivided block, without flattening it.
+    """
+    width = 2**(board.max_depth - board.level)
+    planes = [0] * len(COLOUR_LIST)
+    squares = {}
+    stack = [(board, 0, 0, width)]
+    while stack:
+        block, x, y, size = stack.pop()
+        if block.children != []:
+            half = size // 2
+            stack.append((block.children[0], x + half, y, half))
+            stack.append((block.children[1], x, y, half))
+            stack.append((block.children[2], x, y + half, half))
+            stack.append((block.children[3], x + half, y + half, half))
+        elif block.colour in _COLOUR_INDEX:
+            if size not in squares:
+                squares[size] = _square(size, width)
+            planes[_COLOUR_INDEX[block.colour]] |= \
+                squares[size] << (y * width + x)
+    return Bitboard(width, planes)
+
+
+def _square(size: int, width: int) -> int:
+    """Return the mask of a <size> by <size> square of cells in the top left
+    corner of a board <width> cells across.
+    """
+    row = (1 << size) - 1
+    mask = 0
+    for y in range(size):
+        mask |= row << (y * width)
+    return mask
+
+
+def _edge_masks(width: int) -> Tuple[int, ...]:
+    """Return the masks used by a Bitboard <width> cells across.
+    """
+    if width not in _EDGE_MASKS:
+        full = (1 << (width * width)) - 1
+        top = (1 << width) - 1
+        bottom = top << (width * (width - 1))
+        left = 0
+        for y in range(width):
+            left |= 1 << (y * width)
+        right = left << (width - 1)
+        _EDGE_MASKS[width] = (top, bottom, left, right,
+                              full & ~left, full & ~right)
+    return _EDGE_MASKS[width]
+
+
+# The index of each colour in COLOUR_LIST
+_COLOUR_INDEX = {colour: i for i, colour in enumerate(COLOUR_LIST)}
+
+# The masks used by Bitboards, by width
+_EDGE_MASKS: Dict[int, Tuple[int, ...]] = {}
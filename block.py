@@ -10,15 +10,60 @@ University of Toronto
 
 This file contains the Block class, the main data structure used in the game.
 """
-from typing import Optional, Tuple, List, Union
+from typing import Optional, Tuple, List, Union, Iterator
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
 import random
 import math
+import sys
+import weakref
 from renderer import COLOUR_LIST, TEMPTING_TURQUOISE, BLACK
 
 
 HIGHLIGHT_COLOUR = TEMPTING_TURQUOISE
 FRAME_COLOUR = BLACK
 
+# The largest number of discarded Blocks kept for reuse by random_init.
+# Set it to 0 to turn recycling off.
+FREE_LIST_LIMIT = 4096
+
+# How many Blocks random_init has created from scratch, how many it has
+# reused from the free list, and how many discarded Blocks were recycled.
+ALLOCATION_COUNTS = {'created': 0, 'reused': 0, 'released': 0}
+
+# Blocks discarded by smash, waiting to be reused.
+_FREE_BLOCKS = []
+
+# The number of distinct random words used by random_board, and how many
+# of them it generates at a time
+_WORDS = 2 ** 64
+_WORD_BATCH = 256
+
+# The split thresholds used by random_board, by max_depth
+_SPLIT_TABLES = {}
+
+# The largest number of unit cells kept in the rasters cached by flatten,
+# over all Blocks.  Set it to 0 to turn raster caching off.
+RASTER_CACHE_LIMIT = 2 ** 20
+
+# How many unit cells the cached rasters hold, how many rasters flatten has
+# reused and built, and how many were dropped to keep within the limit.
+RASTER_CACHE_COUNTS = {'cells': 0, 'hits': 0, 'built': 0, 'evicted': 0}
+
+# Weak references to the Blocks with a cached raster, least recently used
+# first, and the number of unit cells in each raster.  The references are
+# weak so that the cache never keeps a discarded board alive; a Block's
+# entry is removed when it is collected.
+_RASTER_BLOCKS = OrderedDict()
+
+# The _BoardState of each root Block which has needed one.  Boards which are
+# no longer used are dropped automatically.
+_BOARD_STATES = weakref.WeakKeyDictionary()
+
+# The index of each colour in COLOUR_LIST, as used by encode_board
+_COLOUR_INDEX = {colour: i for i, colour in enumerate(COLOUR_LIST)}
+
 
 class Block:
     """A square block in the Blocky game.
@@ -49,6 +94,10 @@ class Block:
         lower-left child, lower-right child.
     parent:
         The block that this block is directly within.
+    version:
+        A counter which changes whenever the colours or structure of this
+        Block change, so that results computed from one version of the
+        Block can be reused until the next swap, rotate or smash within it.
 
     === Representation Invariations ===
     - len(children) == 0 or len(children) == 4
@@ -75,6 +124,28 @@ class Block:
     highlighted: bool
     children: List['Block']
     parent: Optional['Block']
+    version: int
+    # === Private Attributes ===
+    # _snapshot:
+    #     The most recent BoardSnapshot of this Block, or None
+    # _snapshot_version:
+    #     The version of this Block which _snapshot was taken at
+    # _index_slot:
+    #     The position of this Block in its level's list in the BlockIndex
+    #     of its board, if that has been built
+    # _raster:
+    #     The columns of unit cells of this Block, as returned by flatten,
+    #     or None.  Only subdivided Blocks cache their raster.
+    # _raster_version:
+    #     The version of this Block which _raster shows
+    #
+    # The state which only the root Block of a board needs is kept apart,
+    # in _BOARD_STATES.
+    _snapshot: Optional['BoardSnapshot']
+    _snapshot_version: int
+    _index_slot: int
+    _raster: Optional[Tuple[Tuple[Tuple[int, int, int], ...], ...]]
+    _raster_version: int
 
     def __init__(self, level: int,
                  colour: Optional[Tuple[int, int, int]] = None,
@@ -85,7 +156,7 @@ class Block:
         If <children> is None, give this block no children.  Otherwise
         give it the provided children.  Use the provided level and colour,
         and set everything else (x and y coordinates, size,
-        and max_depth) to 0.  (All attributes can be updated later, as
+        max_depth and version) to 0.  (All attributes can be updated later, as
         appropriate.)
         """
         self.position = (0, 0)
@@ -99,6 +170,12 @@ class Block:
         else:
             self.children = children
         self.parent = None
+        self.version = 0
+        self._snapshot = None
+        self._snapshot_version = 0
+        self._index_slot = -1
+        self._raster = None
+        self._raster_version = 0
 
     def rectangles_to_draw(self) -> List[Tuple[Tuple[int, int, int],
                                                Tuple[float, float],
@@ -164,17 +241,27 @@ class Block:
         if self.children == []:
             return
 
-        elif direction == 0:  # Swap horizontally
+        raster = self._valid_raster()
+        half = 2**(self.max_depth - self.level - 1)
+        if direction == 0:  # Swap horizontally
             self.children = [self.children[1], self.children[0],
                              self.children[3], self.children[2]]
-
-            self.update_block_locations(self.position, self.size)
+            if raster is not None:
+                raster = raster[half:] + raster[:half]
 
         else:  # Swap vertically
             self.children = [self.children[3], self.children[2],
                              self.children[1], self.children[0]]
+            if raster is not None:
+                raster = tuple(column[half:] + column[:half]
+                               for column in raster)
 
-            self.update_block_locations(self.position, self.size)
+        self.update_block_locations(self.position, self.size)
+        root = self._mark_changed()
+        if raster is not None:
+            self._raster = raster
+            self._raster_version = self.version
+        _record_delta(root, self, 2 + direction)
 
     def rotate(self, direction: int) -> None:
         """Rotate this Block and all its descendants.
@@ -185,23 +272,35 @@ class Block:
         if self.children == []:
             return
 
-        elif direction == 1:  # Rotate clockwise
+        raster = self._valid_raster()
+        self._rotate_descendants(direction)
+        self.update_block_locations(self.position, self.size)
+        root = self._mark_changed()
+        if raster is not None:
+            self._raster = _rotate_raster(raster, direction)
+            self._raster_version = self.version
+        _record_delta(root, self, 0 if direction == 1 else 1)
+
+    def _rotate_descendants(self, direction: int) -> None:
+        """Rotate the children of this Block and all their descendants in
+        the given <direction>, without updating their locations.
+        """
+        if direction == 1:  # Rotate clockwise
             self.children = [self.children[1], self.children[2],
                              self.children[3], self.children[0]]
 
-            for child in self.children:
-                child.rotate(direction)
-
-            self.update_block_locations(self.position, self.size)
-
         else:  # Rotate counter-clockwise
             self.children = [self.children[3], self.children[0],
                              self.children[1], self.children[2]]
 
-            for child in self.children:
-                child.rotate(direction)
-
-            self.update_block_locations(self.position, self.size)
+        for child in self.children:
+            if child.children != []:
+                raster = child._valid_raster()
+                child._rotate_descendants(direction)
+                child.version += 1
+                if raster is not None:
+                    child._raster = _rotate_raster(raster, direction)
+                    child._raster_version = child.version
 
     def smash(self, max_depth: int) -> bool:
         """Smash this block.
@@ -220,15 +319,104 @@ class Block:
             return False
 
         else:
-            self.children = [random_init(self.level+1, max_depth)
-                             for _ in range(4)]
+            self._replace_children()
+            return True
 
-            for child in self.children:
-                child.parent = self
+    def _replace_children(self, children: Optional[List['Block']] = None) \
+            -> None:
+        """Discard the children of this Block, and give it <children>
+        instead, or four randomly-generated children if <children> is None,
+        as smash does.
+        """
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        state = _BOARD_STATES.get(root)
+        index = None if state is None else state.block_index
+        if index is not None:
+            index.discard(self)
+        # The old children are discarded, so recycle them for the new
+        for child in self.children:
+            _release(child)
+        if children is None:
+            children = [random_init(self.level + 1, self.max_depth)
+                        for _ in range(4)]
+        self.children = children
 
-            self.update_block_locations(self.position, self.size)
+        for child in self.children:
+            child.parent = self
+        if index is not None:
+            index.add(self)
 
-            return True
+        self.update_block_locations(self.position, self.size)
+        self._mark_changed()
+        _record_delta(root, self, 4)
+
+    def _mark_changed(self) -> 'Block':
+        """Record that the contents of this Block have changed, which also
+        changes the contents of every Block it is within.
+
+        Return the root Block, which this Block is within.
+        """
+        block = self
+        while True:
+            block.version += 1
+            if block.parent is None:
+                return block
+            block = block.parent
+
+    def path(self) -> Tuple[int, ...]:
+        """Return the indices of the children to follow from the root Block
+        to reach this Block.
+        """
+        path = []
+        block = self
+        while block.parent is not None:
+            path.append(block.parent.children.index(block))
+            block = block.parent
+        return tuple(reversed(path))
+
+    def record_deltas(self) -> None:
+        """Start recording a delta, as returned by encode_delta, for every
+        swap, rotation and smash within this board, to be collected with
+        take_deltas.
+
+        Precondition: this Block has no parent.
+        """
+        state = _board_state(self)
+        if state.deltas is None:
+            state.deltas = []
+
+    def take_deltas(self) -> List[bytes]:
+        """Return the deltas recorded for this board since record_deltas
+        was called or take_deltas last returned, oldest first, and start
+        recording afresh.
+
+        Precondition: record_deltas has been called on this Block.
+        """
+        state = _board_state(self)
+        deltas = state.deltas
+        state.deltas = []
+        return deltas
+
+    @contextmanager
+    def deltas_paused(self) -> Iterator[None]:
+        """Within the with statement, record no deltas for this board, as
+        for moves which are tried and then undone.  Recording, if any,
+        resumes afterwards as if the moves had never been made.
+
+        Precondition: this Block has no parent.
+        """
+        state = _BOARD_STATES.get(self)
+        if state is None:
+            yield
+            return
+        deltas = state.deltas
+        state.deltas = None
+        try:
+            yield
+        finally:
+            state.deltas = deltas
 
     def update_block_locations(self, top_left: Tuple[float, float],
                                size: float) -> None:
@@ -286,6 +474,39 @@ class Block:
             return self.children[3].get_colour_at_square(x - halfway,
                                                          y - halfway)
 
+    def pick_block(self, location: Tuple[float, float], level: int) \
+            -> 'Block':
+        """Return the same Block as get_selected_block(<location>, <level>),
+        for a <location> in whole pixels, in constant time.
+
+        The first call after the layout of this Block changes builds an
+        index from each unit cell and level to the Block there, and from
+        each pixel to its unit cell.  Later calls only look the Block up.
+        Locations outside this Block pick the nearest Block on its edge.
+
+        Preconditions:
+        - 0 <= level <= max_depth
+        - this Block is at position (0, 0), as get_selected_block assumes
+        """
+        state = _board_state(self)
+        index = state.pick_index
+        layout = (self.version, self.position, self.size)
+        if index is None or state.pick_layout != layout:
+            index = _PickIndex(self)
+            state.pick_index = index
+            state.pick_layout = layout
+        last = index.last_pixel
+        x = int(location[0])
+        y = int(location[1])
+        if not 0 <= x <= last:
+            x = 0 if x < 0 else last
+        if not 0 <= y <= last:
+            y = 0 if y < 0 else last
+        depth = level - self.level
+        if not 0 <= depth < len(index.levels):
+            depth = 0 if depth < 0 else len(index.levels) - 1
+        return index.levels[depth][index.columns[x] + index.rows[y]]
+
     def get_selected_block(self, location: Tuple[float, float], level: int) \
             -> 'Block':
         """Return the Block within this Block that includes the given location
@@ -334,11 +555,80 @@ class Block:
         of the block at the cell location[i][j]
 
         L[0][0] represents the unit cell in the upper left corner of the Block.
+
+        The result is copied from the raster cached by each subdivided
+        Block, which is built by joining the columns of its children's
+        rasters.  Swaps and rotations transform the cached rasters instead
+        of discarding them, so after a move only the rasters of the moved
+        Block's ancestors are rebuilt.
         """
-        width = 2**(self.max_depth - self.level)
-        flattened = [[self.get_colour_at_square(x, y) for y in range(width)]
-                     for x in range(width)]
-        return flattened
+        return [list(column) for column in self._build_raster()]
+
+    def _build_raster(self) -> Tuple[Tuple[Tuple[int, int, int], ...], ...]:
+        """Return the columns of unit cells of this Block, as returned by
+        flatten, from the cache if it is up to date.
+        """
+        if self.children == []:
+            width = 2**(self.max_depth - self.level)
+            return ((self.colour,) * width,) * width
+        raster = self._valid_raster()
+        if raster is not None:
+            RASTER_CACHE_COUNTS['hits'] += 1
+            key = weakref.ref(self)
+            if key in _RASTER_BLOCKS:
+                _RASTER_BLOCKS.move_to_end(key)
+            return raster
+        upper_right, upper_left, lower_left, lower_right = \
+            [child._build_raster() for child in self.children]
+        raster = tuple(top + bottom
+                       for top, bottom in zip(upper_left, lower_left)) + \
+            tuple(top + bottom
+                  for top, bottom in zip(upper_right, lower_right))
+        RASTER_CACHE_COUNTS['built'] += 1
+        _cache_raster(self, raster)
+        return raster
+
+    def _valid_raster(self) \
+            -> Optional[Tuple[Tuple[Tuple[int, int, int], ...], ...]]:
+        """Return the cached raster of this Block, or None if there is none
+        for its current version.
+        """
+        if self._raster is not None and self._raster_version == self.version:
+            return self._raster
+        return None
+
+    def snapshot(self) -> 'BoardSnapshot':
+        """Return an immutable BoardSnapshot of the current version of this
+        Block.
+
+        Snapshots share structure: the snapshot of a Block is reused until
+        the Block's version changes, so after a move only the snapshots of
+        the changed blocks and their ancestors are rebuilt.
+        """
+        if self._snapshot is not None and \
+                self._snapshot_version == self.version:
+            return self._snapshot
+        children = tuple(child.snapshot() for child in self.children)
+        self._snapshot = BoardSnapshot(self.level, self.max_depth,
+                                       self.colour, children)
+        self._snapshot_version = self.version
+        return self._snapshot
+
+    def block_index(self) -> 'BlockIndex':
+        """Return the BlockIndex of the board this Block is the root of.
+
+        The index is built the first time it is asked for, and is then
+        kept up to date by smash.  Swaps and rotations only move Blocks
+        around, so they leave it unchanged.
+
+        Precondition: this Block has no parent, and the Blocks within it
+        are only changed with swap, rotate and smash.
+        """
+        state = _board_state(self)
+        if state.block_index is None:
+            state.block_index = BlockIndex(self.max_depth)
+            state.block_index.add(self)
+        return state.block_index
 
 
 def random_init(level: int, max_depth: int) -> 'Block':
@@ -359,17 +649,690 @@ def random_init(level: int, max_depth: int) -> 'Block':
     children = None
     if level < max_depth and random.random() < math.exp(-0.25 * level):
         children = [random_init(level + 1, max_depth) for _ in range(4)]
-        block = Block(level, colour, children)
+        block = _new_block(level, colour, children)
         block.max_depth = max_depth
         for child in block.children:
             child.parent = block
     else:
         colour = COLOUR_LIST[random.randint(0, 3)]
-        block = Block(level, colour, children)
+        block = _new_block(level, colour, children)
+        block.max_depth = max_depth
+    return block
+
+
+def _new_block(level: int, colour: Optional[Tuple[int, int, int]],
+               children: Optional[List[Block]]) -> Block:
+    """Return a Block initialized as Block(level, colour, children) would,
+    reusing a Block from the free list when there is one.
+    """
+    if _FREE_BLOCKS == []:
+        ALLOCATION_COUNTS['created'] += 1
+        return Block(level, colour, children)
+    ALLOCATION_COUNTS['reused'] += 1
+    block = _FREE_BLOCKS.pop()
+    # Keep the version increasing, so that nothing cached for the
+    # discarded Block is mistaken for this one.
+    version = block.version
+    block.__init__(level, colour, children)
+    block.version = version + 1
+    return block
+
+
+def _release(block: Block) -> None:
+    """Put <block> and all its descendants on the free list, up to
+    FREE_LIST_LIMIT Blocks.
+
+    Precondition: nothing refers to <block> or its descendants any more.
+    """
+    for child in block.children:
+        _release(child)
+    block.children = []
+    block.parent = None
+    block._snapshot = None
+    _BOARD_STATES.pop(block, None)
+    _drop_raster(block)
+    if len(_FREE_BLOCKS) < FREE_LIST_LIMIT:
+        ALLOCATION_COUNTS['released'] += 1
+        _FREE_BLOCKS.append(block)
+
+
+def _cache_raster(block: Block,
+                  raster: Tuple[Tuple[Tuple[int, int, int], ...], ...]) \
+        -> None:
+    """Cache <raster> as the raster of the current version of <block>, then
+    drop the least recently used rasters until at most RASTER_CACHE_LIMIT
+    unit cells are cached.
+    """
+    _drop_raster(block)
+    cells = len(raster) ** 2
+    if cells > RASTER_CACHE_LIMIT:
+        return
+    block._raster = raster
+    block._raster_version = block.version
+    _RASTER_BLOCKS[weakref.ref(block, _forget_raster)] = cells
+    RASTER_CACHE_COUNTS['cells'] += cells
+    while RASTER_CACHE_COUNTS['cells'] > RASTER_CACHE_LIMIT:
+        oldest, cells = _RASTER_BLOCKS.popitem(last=False)
+        RASTER_CACHE_COUNTS['cells'] -= cells
+        RASTER_CACHE_COUNTS['evicted'] += 1
+        oldest = oldest()
+        if oldest is not None:
+            oldest._raster = None
+
+
+def _drop_raster(block: Block) -> None:
+    """Discard the cached raster of <block>, if it has one.
+    """
+    block._raster = None
+    cells = _RASTER_BLOCKS.pop(weakref.ref(block), None)
+    if cells is not None:
+        RASTER_CACHE_COUNTS['cells'] -= cells
+
+
+def _forget_raster(key: 'weakref.ref[Block]') -> None:
+    """Remove the entry of a collected Block, whose weak reference is <key>,
+    from the raster cache.
+    """
+    cells = _RASTER_BLOCKS.pop(key, None)
+    if cells is not None:
+        RASTER_CACHE_COUNTS['cells'] -= cells
+
+
+def _board_state(root: Block) -> '_BoardState':
+    """Return the _BoardState of the board whose root Block is <root>,
+    creating it the first time it is asked for.
+    """
+    state = _BOARD_STATES.get(root)
+    if state is None:
+        state = _BoardState()
+        _BOARD_STATES[root] = state
+    return state
+
+
+def _record_delta(root: Block, block: Block, move: int) -> None:
+    """Record the delta of the move with code <move> just made to <block>,
+    if the deltas of the board whose root Block is <root> are being
+    recorded.
+    """
+    state = _BOARD_STATES.get(root)
+    if state is not None and state.deltas is not None:
+        state.deltas.append(encode_delta(block, move))
+
+
+def _rotate_raster(raster: Tuple[Tuple[Tuple[int, int, int], ...], ...],
+                   direction: int) \
+        -> Tuple[Tuple[Tuple[int, int, int], ...], ...]:
+    """Return <raster> rotated clockwise if <direction> is 1, and
+    counterclockwise if <direction> is 3.
+    """
+    rows = tuple(zip(*raster))
+    if direction == 1:
+        return rows[::-1]
+    return tuple(row[::-1] for row in rows)
+
+
+def reset_allocation_counts() -> None:
+    """Reset all the counts in ALLOCATION_COUNTS to 0.
+    """
+    for key in ALLOCATION_COUNTS:
+        ALLOCATION_COUNTS[key] = 0
+
+
+def random_board(max_depth: int,
+                 rng: Optional[random.Random] = None) -> Block:
+    """Return a randomly-generated root Block subdivided to a maximum depth
+    of <max_depth>, with the same distribution as random_init(0, max_depth).
+
+    The board is built in one pre-order pass, drawing a single random
+    64-bit word per Block from words generated in bulk by <rng>.  A Block
+    is subdivided iff its word is below the threshold for its level;
+    otherwise the word's position above the threshold picks its colour.
+    If <rng> is None, a generator seeded from the random module is used.
+
+    As with random_init, position and size are left for the client to set.
+    """
+    if rng is None:
+        rng = random.Random(random.getrandbits(64))
+    thresholds, spans = _split_table(max_depth)
+    words = _random_words(rng)
+    root = None
+    # The Blocks still to generate, as (parent, level) pairs
+    stack = [(None, 0)]
+    while stack:
+        parent, level = stack.pop()
+        word = next(words)
+        if word < thresholds[level]:
+            block = _new_block(level, None, None)
+            stack.extend([(block, level + 1)] * 4)
+        else:
+            colour = COLOUR_LIST[(word - thresholds[level]) * 4 //
+                                 spans[level]]
+            block = _new_block(level, colour, None)
+        block.max_depth = max_depth
+        if parent is None:
+            root = block
+        else:
+            block.parent = parent
+            parent.children.append(block)
+    return root
+
+
+def game_rng(seed: int, game_index: int) -> random.Random:
+    """Return the random number generator for game number <game_index> of
+    the run with the given <seed>.
+
+    Each game gets its own independent stream, so games can be generated
+    in any order, or in parallel, and still be reproduced exactly.
+    """
+    return random.Random(f'{seed}/{game_index}')
+
+
+def encode_board(board: Block) -> bytes:
+    """Return a compact binary encoding of <board>.
+
+    The first two bytes are the max_depth and the level of <board>.  They
+    are followed by a pre-order bit stream with one bit per Block, 1 if it
+    is subdivided and 0 if not, and after each undivided Block two bits for
+    the index of its colour in COLOUR_LIST.  The stream is padded with
+    zero bits to a whole number of bytes.
+
+    Precondition: every colour in <board> is in COLOUR_LIST.
+    """
+    data = bytearray([board.max_depth, board.level])
+    # Bits not yet written to <data>, and how many there are
+    buffer = 0
+    num_bits = 0
+    stack = [board]
+    while stack:
+        block = stack.pop()
+        if block.children == []:
+            buffer = (buffer << 3) | _COLOUR_INDEX[block.colour]
+            num_bits += 3
+        else:
+            buffer = (buffer << 1) | 1
+            num_bits += 1
+            stack.extend(reversed(block.children))
+        if num_bits >= 8:
+            num_bits -= 8
+            data.append(buffer >> num_bits)
+            buffer &= (1 << num_bits) - 1
+    if num_bits > 0:
+        data.append(buffer << (8 - num_bits))
+    return bytes(data)
+
+
+def decode_board(data: bytes) -> Block:
+    """Return a new Block from its encoding <data>, as produced by
+    encode_board.
+
+    As with random_init, position and size are left for the client to set.
+    """
+    max_depth = data[0]
+    root = None
+    # The index of the next bit to read, counting from the third byte
+    position = 16
+    # The Blocks still to decode, as (parent, level) pairs
+    stack = [(None, data[1])]
+    while stack:
+        parent, level = stack.pop()
+        bit = (data[position >> 3] >> (7 - (position & 7))) & 1
+        position += 1
+        if bit == 1:
+            block = _new_block(level, None, None)
+            stack.extend([(block, level + 1)] * 4)
+        else:
+            index = 0
+            for _ in range(2):
+                index = (index << 1) | \
+                    ((data[position >> 3] >> (7 - (position & 7))) & 1)
+                position += 1
+            block = _new_block(level, COLOUR_LIST[index], None)
         block.max_depth = max_depth
+        if parent is None:
+            root = block
+        else:
+            block.parent = parent
+            parent.children.append(block)
+    return root
+
+
+def encode_delta(block: Block, move: int) -> bytes:
+    """Return a compact encoding of the move with code <move>, which has
+    just been made on <block>, for replaying on a copy of its board with
+    apply_delta.
+
+    The move codes are those of the game server: 0 to rotate clockwise, 1
+    to rotate counterclockwise, 2 to swap horizontally, 3 to swap
+    vertically and 4 to smash.  The first byte is the move code and the
+    second the length of the path to <block>, followed by the path at two
+    bits per child index, padded to a whole number of bytes.  A smash is
+    followed by encode_board of <block>, holding its new children.
+    """
+    path = block.path()
+    data = bytearray([move, len(path)])
+    for start in range(0, len(path), 4):
+        packed = 0
+        for i in range(start, start + 4):
+            packed = (packed << 2) | (path[i] if i < len(path) else 0)
+        data.append(packed)
+    if move == 4:
+        data += encode_board(block)
+    return bytes(data)
+
+
+def apply_delta(board: Block, delta: bytes) -> Block:
+    """Make the move encoded in <delta> by encode_delta on <board>, and
+    return the Block it was made on.
+
+    Precondition: <board> is a copy of the board the delta was recorded
+    on, as it was just before the move.
+    """
+    move = delta[0]
+    block = board
+    for i in range(delta[1]):
+        index = (delta[2 + i // 4] >> (6 - 2 * (i % 4))) & 3
+        block = block.children[index]
+    if move == 0:
+        block.rotate(1)
+    elif move == 1:
+        block.rotate(3)
+    elif move == 2:
+        block.swap(0)
+    elif move == 3:
+        block.swap(1)
+    else:
+        smashed = decode_board(delta[2 + (delta[1] + 3) // 4:])
+        children = smashed.children
+        smashed.children = []
+        _release(smashed)
+        block._replace_children(children)
     return block
 
 
+def _split_table(max_depth: int) -> Tuple[List[int], List[int]]:
+    """Return, for every level up to <max_depth>, the 64-bit threshold below
+    which a Block at that level is subdivided, and the number of words at
+    or above that threshold.
+
+    A Block at level i is subdivided with probability exp(-0.25 * i), unless
+    i == max_depth.
+    """
+    if max_depth not in _SPLIT_TABLES:
+        thresholds = [min(int(math.exp(-0.25 * level) * _WORDS), _WORDS)
+                      for level in range(max_depth)] + [0]
+        spans = [_WORDS - threshold for threshold in thresholds]
+        _SPLIT_TABLES[max_depth] = (thresholds, spans)
+    return _SPLIT_TABLES[max_depth]
+
+
+def _random_words(rng: random.Random) -> Iterator[int]:
+    """Yield random 64-bit words from <rng>, generated _WORD_BATCH at a time.
+    """
+    while True:
+        words = array('Q', rng.randbytes(8 * _WORD_BATCH))
+        if sys.byteorder == 'big':
+            # Give the same words on every platform
+            words.byteswap()
+        yield from words
+
+
+class BlockIndex:
+    """The Blocks of a board, listed by level, so that they can be drawn at
+    random or visited level by level without walking the tree.
+
+    === Public Attributes ===
+    levels:
+        levels[i] lists the Blocks at level i, in no particular order.
+    num_leaves:
+        The number of Blocks in the index which are not subdivided.
+    num_internal:
+        The number of Blocks in the index which are subdivided.
+
+    === Representation Invariants ===
+    - len(levels) == max_depth + 1 of the board
+    - each Block in levels[i] is at level i, and its _index_slot is its
+      position in levels[i]
+    """
+    levels: List[List[Block]]
+    num_leaves: int
+    num_internal: int
+
+    def __init__(self, max_depth: int) -> None:
+        """Initialize this index to be empty, for a board with the given
+        <max_depth>.
+        """
+        self.levels = [[] for _ in range(max_depth + 1)]
+        self.num_leaves = 0
+        self.num_internal = 0
+
+    def __len__(self) -> int:
+        """Return the number of Blocks in this index.
+        """
+        return self.num_leaves + self.num_internal
+
+    def add(self, block: Block) -> None:
+        """Add <block> and all its descendants to this index.
+        """
+        stack = [block]
+        while stack:
+            block = stack.pop()
+            level = self.levels[block.level]
+            block._index_slot = len(level)
+            level.append(block)
+            if block.children == []:
+                self.num_leaves += 1
+            else:
+                self.num_internal += 1
+                stack.extend(block.children)
+
+    def discard(self, block: Block) -> None:
+        """Remove <block> and all its descendants from this index.
+
+        Each Block is removed in constant time, by moving the last Block
+        of its level into its place.
+
+        Precondition: <block> and its descendants are in this index.
+        """
+        stack = [block]
+        while stack:
+            block = stack.pop()
+            level = self.levels[block.level]
+            last = level.pop()
+            if last is not block:
+                level[block._index_slot] = last
+                last._index_slot = block._index_slot
+            block._index_slot = -1
+            if block.children == []:
+                self.num_leaves -= 1
+            else:
+                self.num_internal -= 1
+                stack.extend(block.children)
+
+    def internal_blocks(self) -> Iterator[Block]:
+        """Yield every subdivided Block in this index, level by level from
+        the top.
+        """
+        for level in self.levels:
+            for block in level:
+                if block.children != []:
+                    yield block
+
+    def random_block(self, rng: random.Random,
+                     level_weights: Optional[List[float]] = None) -> Block:
+        """Return a Block from this index chosen with <rng>.
+
+        If <level_weights> is None, every Block is equally likely.
+        Otherwise a level is chosen first, with level i chosen with
+        probability proportional to level_weights[i] among the levels which
+        have Blocks, and then a Block is chosen uniformly from that level.
+        Either way this takes time proportional to the number of levels,
+        not the number of Blocks.
+
+        Precondition: this index is not empty, and if <level_weights> is
+        given, it has a positive weight for some level which has Blocks.
+        """
+        if level_weights is None:
+            choice = rng.randrange(len(self))
+            for level in self.levels:
+                if choice < len(level):
+                    return level[choice]
+                choice -= len(level)
+        weights = [weight if level != [] else 0
+                   for weight, level in zip(level_weights, self.levels)]
+        level = rng.choices(self.levels[:len(weights)], weights)[0]
+        return level[rng.randrange(len(level))]
+
+
+class _BoardState:
+    """The state which only the root Block of a board needs, kept apart from
+    the Blocks so that the many Blocks within a board do not carry it.
+
+    === Attributes ===
+    pick_index:
+        The index used by Block.pick_block, or None if it has not been built
+    pick_layout:
+        The version, position and size of the root Block when pick_index
+        was built
+    block_index:
+        The BlockIndex of the board, or None if it has not been built
+    deltas:
+        The deltas of the changes made to the board since they were last
+        taken, or None if they are not being recorded
+    """
+    pick_index: Optional['_PickIndex']
+    pick_layout: Optional[Tuple[int, Tuple[float, float], float]]
+    block_index: Optional['BlockIndex']
+    deltas: Optional[List[bytes]]
+
+    def __init__(self) -> None:
+        """Initialize the state of a board which has needed none yet.
+        """
+        self.pick_index = None
+        self.pick_layout = None
+        self.block_index = None
+        self.deltas = None
+
+
+class _PickIndex:
+    """An index for Block.pick_block, from pixels and levels to the Blocks
+    within one layout of a Block.
+
+    === Attributes ===
+    last_pixel:
+        The largest whole pixel offset from the Block's edge in the index
+    columns:
+        For each whole pixel offset from the Block's left edge, up to
+        last_pixel, the position in a grid of levels of the first unit cell
+        in the column of cells which contains it
+    rows:
+        For each whole pixel offset from the Block's top edge, up to
+        last_pixel, the row of unit cells which contains it
+    levels:
+        For each level at or below the Block's level, counting from the
+        Block's level, a grid holding the Block at or above that level in
+        each unit cell.  The cell in column x and row y is at
+        x * 2^(max_depth - level) + y.
+    """
+    last_pixel: int
+    columns: List[int]
+    rows: List[int]
+    levels: List[List[Block]]
+
+    def __init__(self, block: Block) -> None:
+        """Initialize this index of the current layout of <block>.
+        """
+        width = 2**(block.max_depth - block.level)
+        cell_size = block.size / width
+        self.last_pixel = math.ceil(block.size)
+        self.rows = [min(int(pixel // cell_size), width - 1)
+                     if cell_size > 0 else 0
+                     for pixel in range(self.last_pixel + 1)]
+        self.columns = [row * width for row in self.rows]
+        self.levels = [[block] * (width * width)
+                       for _ in range(block.max_depth - block.level + 1)]
+        self._fill(block, block.level, 0, 0, width, width)
+
+    def _fill(self, block: Block, base: int, x: int, y: int,
+              width: int, total_width: int) -> None:
+        """Record <block>, which covers the <width> by <width> unit cells
+        starting at column <x> and row <y>, in every level it is picked at.
+        <base> is the level of the indexed Block, and <total_width> its
+        width in unit cells.
+        """
+        if block.children == []:
+            levels = self.levels[block.level - base:]
+        else:
+            levels = [self.levels[block.level - base]]
+        for grid in levels:
+            for column in range(x, x + width):
+                start = column * total_width + y
+                grid[start:start + width] = [block] * width
+        if block.children != []:
+            half = width // 2
+            self._fill(block.children[0], base, x + half, y, half,
+                       total_width)
+            self._fill(block.children[1], base, x, y, half, total_width)
+            self._fill(block.children[2], base, x, y + half, half,
+                       total_width)
+            self._fill(block.children[3], base, x + half, y + half, half,
+                       total_width)
+
+
+class BoardSnapshot:
+    """An immutable view of a Block, for trying out moves without changing
+    the Block or undoing them afterwards.
+
+    Moves on a BoardSnapshot return a new BoardSnapshot, and the original
+    is left unchanged.  The new snapshot copies only the blocks from the
+    root to the block which was moved (and, for a rotation, the rotated
+    block's descendants, since all of them change); everything else is
+    shared with the original.  Snapshots can therefore be explored
+    concurrently, and can be scored by any Goal, like a Block.
+
+    A block within a snapshot is identified by its path: the sequence of
+    child indices leading to it from the snapshot's root, in the child
+    order used by Block.
+
+    === Public Attributes ===
+    level:
+        The level of this block within the overall block structure.
+    max_depth:
+        The deepest level allowed in the overall block structure.
+    colour:
+        The colour of this block if it is not subdivided, and None
+        otherwise.
+    children:
+        The snapshots of the four children of this block, or an empty tuple.
+    version:
+        Always 0, since a snapshot never changes.
+    """
+    __slots__ = ('level', 'max_depth', 'colour', 'children', '__weakref__')
+    version = 0
+
+    level: int
+    max_depth: int
+    colour: Optional[Tuple[int, int, int]]
+    children: Tuple['BoardSnapshot', ...]
+
+    def __init__(self, level: int, max_depth: int,
+                 colour: Optional[Tuple[int, int, int]],
+                 children: Tuple['BoardSnapshot', ...]) -> None:
+        """Initialize this snapshot with the given attributes.
+        """
+        self.level = level
+        self.max_depth = max_depth
+        self.colour = colour
+        self.children = children
+
+    def get_block(self, path: Tuple[int, ...]) -> 'BoardSnapshot':
+        """Return the block at <path> within this snapshot.
+
+        Precondition: <path> leads to a block within this snapshot.
+        """
+        block = self
+        for index in path:
+            block = block.children[index]
+        return block
+
+    def swap(self, path: Tuple[int, ...], direction: int) \
+            -> 'BoardSnapshot':
+        """Return the snapshot resulting from swapping the children of the
+        block at <path>, as Block.swap would.
+        """
+        block = self.get_block(path)
+        if block.children == ():
+            return self
+        ur, ul, ll, lr = block.children
+        if direction == 0:  # Swap horizontally
+            children = (ul, ur, lr, ll)
+        else:  # Swap vertically
+            children = (lr, ll, ul, ur)
+        return self._replace(path, block._with_children(children))
+
+    def rotate(self, path: Tuple[int, ...], direction: int) \
+            -> 'BoardSnapshot':
+        """Return the snapshot resulting from rotating the block at <path>,
+        as Block.rotate would.
+        """
+        block = self.get_block(path)
+        if block.children == ():
+            return self
+        return self._replace(path, block._rotated(direction))
+
+    def smash(self, path: Tuple[int, ...]) -> 'BoardSnapshot':
+        """Return the snapshot resulting from smashing the block at <path>,
+        as Block.smash would, or this snapshot if it cannot be smashed.
+        """
+        block = self.get_block(path)
+        if block.level == block.max_depth or block.level == 0:
+            return self
+        children = []
+        for _ in range(4):
+            new_block = random_init(block.level + 1, block.max_depth)
+            children.append(new_block.snapshot())
+            _release(new_block)
+        return self._replace(path, block._with_children(tuple(children)))
+
+    def flatten(self) -> List[List[Tuple[int, int, int]]]:
+        """Return a two-dimensional list representing this snapshot as rows
+        and columns of unit cells, in the same format as Block.flatten.
+        """
+        width = 2**(self.max_depth - self.level)
+        if self.children == ():
+            return [[self.colour] * width for _ in range(width)]
+        upper_right, upper_left, lower_left, lower_right = \
+            [child.flatten() for child in self.children]
+        return [upper_left[x] + lower_left[x] for x in range(width // 2)] + \
+            [upper_right[x] + lower_right[x] for x in range(width // 2)]
+
+    def to_block(self) -> Block:
+        """Return a new Block with the same structure and colours as this
+        snapshot.
+
+        As with random_init, the position and size of the new Block are
+        left for the client to set using update_block_locations.
+        """
+        children = [child.to_block() for child in self.children]
+        block = Block(self.level, self.colour, children)
+        block.max_depth = self.max_depth
+        for child in children:
+            child.parent = block
+        return block
+
+    def _with_children(self, children: Tuple['BoardSnapshot', ...]) \
+            -> 'BoardSnapshot':
+        """Return a copy of this snapshot with the given <children>.
+        """
+        return BoardSnapshot(self.level, self.max_depth, self.colour,
+                             children)
+
+    def _rotated(self, direction: int) -> 'BoardSnapshot':
+        """Return a copy of this snapshot, with it and all its descendants
+        rotated in the given <direction>.
+        """
+        if self.children == ():
+            return self
+        ur, ul, ll, lr = [child._rotated(direction)
+                          for child in self.children]
+        if direction == 1:  # Rotate clockwise
+            children = (ul, ll, lr, ur)
+        else:  # Rotate counter-clockwise
+            children = (lr, ur, ul, ll)
+        return self._with_children(children)
+
+    def _replace(self, path: Tuple[int, ...],
+                 block: 'BoardSnapshot') -> 'BoardSnapshot':
+        """Return a copy of this snapshot in which the block at <path> is
+        replaced by <block>, copying only the blocks along <path>.
+        """
+        if path == ():
+            return block
+        index = path[0]
+        child = self.children[index]._replace(path[1:], block)
+        return self._with_children(self.children[:index] + (child,) +
+                                   self.children[index + 1:])
+
+
 def _is_upper_right(x: Union[int, float], y: Union[int, float],
                     halfway: Union[int, float]) -> bool:
     """A helper method that returns whether or not a given
@@ -403,7 +1366,9 @@ if __name__ == '__main__':
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing',
-            'block', 'goal', 'player', 'renderer', 'math'
+            'block', 'goal', 'player', 'renderer', 'math',
+            'array', 'sys', 'collections', 'weakref',
+            'contextlib'
         ],
         'max-attributes': 15
     })
@@ -0,0 +1,188 @@
+"""Not for assignment: a fixed corpus of boards for benchmarking goals
+
+A corpus file holds <count> random boards of one max_depth, generated
+reproducibly from a seed, so that every run of a benchmark scores exactly
+the same boards.  For each board it stores the flattened board, as one byte
+per unit cell holding the index of the cell's colour in COLOUR_LIST, and the
+board's tree, as encoded by block.encode_board.
+
+The file layout is:
+    - a header: the magic bytes b'BLOCKY01', then max_depth, count and the
+      offsets of the encoding table and of the encodings, as 8-byte
+      little-endian unsigned ints
+    - the flattened boards, 4^max_depth bytes each, column by column
+      (cell (x, y) of board i is at byte i * 4^max_depth + x * 2^max_depth + y)
+    - the encoding table, count + 1 offsets as 8-byte little-endian unsigned
+      ints: encoding i runs from offset i to offset i + 1 of the encodings
+    - the encodings
+"""
+
+import argparse
+import mmap
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Iterator
+from block import Block, decode_board, encode_board, game_rng, random_board
+from renderer import COLOUR_LIST
+
+_MAGIC = b'BLOCKY01'
+_HEADER = struct.Struct('<8sQQQQ')
+_COLOUR_INDEX = {colour: i for i, colour in enumerate(COLOUR_LIST)}
+
+
+def generate_corpus(path: str, max_depth: int, count: int,
+                    seed: int = 0) -> None:
+    """Write a corpus of <count> boards of the given <max_depth> to the file
+    at <path>.  Board i is random_board(max_depth, game_rng(seed, i)).
+
+    Boards are written as they are generated, so memory use does not grow
+    with <count> beyond 8 bytes per board for the encoding table.
+    """
+    width = 2 ** max_depth
+    offsets = array('Q', [0])
+    with open(path, 'wb') as corpus, tempfile.TemporaryFile() as encodings:
+        corpus.write(_HEADER.pack(_MAGIC, max_depth, count, 0, 0))
+        for i in range(count):
+            board = random_board(max_depth, game_rng(seed, i))
+            corpus.write(bytes(_COLOUR_INDEX[colour]
+                               for column in board.flatten()
+                               for colour in column))
+            encoding = encode_board(board)
+            encodings.write(encoding)
+            offsets.append(offsets[-1] + len(encoding))
+        table_offset = _HEADER.size + count * width * width
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        corpus.write(offsets.tobytes())
+        encodings.seek(0)
+        shutil.copyfileobj(encodings, corpus)
+        corpus.seek(0)
+        corpus.write(_HEADER.pack(_MAGIC, max_depth, count, table_offset,
+                                  table_offset + 8 * (count + 1)))
+
+
+class BoardCorpus:
+    """A corpus file, memory-mapped so that its boards are read straight
+    from the operating system's page cache instead of being copied.
+
+    Use it as a context manager, or call close when done.  Views returned
+    by a BoardCorpus should be released before it is closed; any which are
+    not keep the memory map open.
+
+    === Public Attributes ===
+    max_depth:
+        The max_depth of every board in the corpus.
+    """
+    max_depth: int
+    # === Private Attributes ===
+    # _file:
+    #     The open corpus file
+    # _map:
+    #     The memory map of _file
+    # _view:
+    #     A memoryview of the whole of _map
+    # _count:
+    #     The number of boards in the corpus
+    # _cells:
+    #     The number of unit cells in each board
+    # _table:
+    #     The offset of the encoding table
+    # _encodings:
+    #     The offset of the encodings
+
+    def __init__(self, path: str) -> None:
+        """Open the corpus file at <path>.
+        """
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        magic, self.max_depth, self._count, self._table, self._encodings = \
+            _HEADER.unpack_from(self._view)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a board corpus')
+        self._cells = 4 ** self.max_depth
+
+    def __len__(self) -> int:
+        """Return the number of boards in this corpus.
+        """
+        return self._count
+
+    def __enter__(self) -> 'BoardCorpus':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def grid(self, i: int) -> memoryview:
+        """Return a read-only view of flattened board <i>, without copying
+        it.  Cell (x, y) of the board is view[x, y], the index in COLOUR_LIST
+        of the colour at column x and row y.
+        """
+        start = _HEADER.size + i * self._cells
+        width = 2 ** self.max_depth
+        return self._view[start:start + self._cells].cast('B', (width, width))
+
+    def encoding(self, i: int) -> memoryview:
+        """Return a read-only view of the encoding of board <i>, without
+        copying it.
+        """
+        start, end = struct.unpack_from('<QQ', self._view,
+                                        self._table + 8 * i)
+        return self._view[self._encodings + start:self._encodings + end]
+
+    def board(self, i: int) -> Block:
+        """Return board <i> as a new Block, with its position at (0, 0) and
+        a size of 2^max_depth.
+        """
+        with self.encoding(i) as encoding:
+            board = decode_board(encoding)
+        board.update_block_locations((0, 0), 2 ** self.max_depth)
+        return board
+
+    def grids(self) -> Iterator[memoryview]:
+        """Yield a view of every flattened board in this corpus, in order.
+
+        Each view is released before the next one is yielded, so it must not
+        be kept.
+        """
+        for i in range(self._count):
+            with self.grid(i) as view:
+                yield view
+
+    def boards(self) -> Iterator[Block]:
+        """Yield every board in this corpus as a new Block, in order.
+        """
+        for i in range(self._count):
+            yield self.board(i)
+
+    def close(self) -> None:
+        """Close this corpus.
+
+        The file is always closed.  If a view returned by this corpus is
+        still alive, the memory map is left open, and is unmapped when it is
+        garbage collected once every view is released; calling close again
+        after releasing them unmaps it at once.
+        """
+        try:
+            self._view.release()
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+        finally:
+            self._file.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate a corpus of random Blocky boards.')
+    parser.add_argument('path')
+    parser.add_argument('max_depth', type=int)
+    parser.add_argument('count', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_corpus(args.path, args.max_depth, args.count, args.seed)
@@ -0,0 +1,432 @@
+"""Not for assignment: hosting many games of Blocky in one process
+
+The server plays each connected client in a game of its own.  Clients talk
+to it over a local TCP socket, one JSON message per line.
+
+A client starts a game by sending
+    {"op": "new", "max_depth": 4, "random_players": 0,
+     "smart_players": [2], "num_turns": 5, "seed": 7, "smart_budget": 0.05}
+(every field but "op" is optional).  With "smart_budget", each smart
+player may take that many seconds per move, whatever its difficulty.  The
+client is Player 0.  The server then sends, whenever it is the client's
+turn,
+    {"type": "your_move", "board": <hex of block.encode_board>}
+the first time, and afterwards
+    {"type": "your_move", "deltas": [<hex of block.encode_delta>, ...]}
+with the deltas of every move made since the last "your_move", the
+client's own included, in order.  The client keeps its copy of the board
+up to date with block.apply_delta.  The client answers with
+    {"op": "move", "path": [child indices from the root], "move": <code>}
+where the move code is 0 to rotate clockwise, 1 to rotate counterclockwise,
+2 to swap horizontally, 3 to swap vertically and 4 to smash.  The server
+replies {"type": "moved", "ok": <bool>}, and asks again if the move was not
+allowed.  At the end of the game it sends
+    {"type": "over", "winner": <index>, "moves": <moves by all players>}
+A client may send {"op": "quit"} at any time to end its game.
+
+"max_depth" must be from 2 to 5, and there may be at most MAX_PLAYERS
+players, counting the client.  If a field of a "new" or "move" message
+has the wrong type or is out of range, the server replies
+    {"type": "error", "message": <what was wrong>}
+and then closes the connection after a "new" message, or waits for
+another move after a "move" message.  A line which is not a JSON object
+ends the connection.
+
+The computer players' moves run in an executor, so a slow SmartPlayer only
+holds up its own game.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from block import Block, apply_delta, decode_board, encode_board, game_rng
+from game_stats import Game
+from goal import Goal
+from player_stats import Player, HumanPlayer
+from renderer import HeadlessRenderer, Renderer
+
+# The most players a game may have, counting the client, and the most
+# seconds a client may give each smart player for a move
+MAX_PLAYERS = 4
+MAX_SMART_BUDGET = 1.0
+
+
+class RemotePlayer(Player):
+    """A human player who plays from a client of the game server.
+
+    Like a HumanPlayer, a RemotePlayer can do a limited number of smashes.
+
+    === Public Attributes ===
+    num_smashes:
+        number of smashes which this RemotePlayer has performed
+    === Representation Invariants ===
+    num_smashes >= 0
+    """
+    num_smashes: int
+
+    def __init__(self, renderer: Renderer, player_id: int, goal: Goal) -> None:
+        """Initialize this RemotePlayer with the given <renderer>, <player_id>
+        and <goal>.
+        """
+        Player.__init__(self, renderer, player_id, goal)
+        self.num_smashes = 0
+
+    def make_move(self, board: Block) -> int:
+        """A RemotePlayer's moves arrive as messages, and are applied by its
+        GameSession with apply_move instead.
+        """
+        raise NotImplementedError
+
+    def apply_move(self, board: Block, path: Tuple[int, ...],
+                   move: int) -> bool:
+        """Apply the move with code <move> to the block at <path> in <board>.
+
+        Return True if the move was made, and False if <path> or <move> is
+        not valid, or the move is a smash which is not allowed.
+        """
+        block = board
+        for index in path:
+            if not 0 <= index < len(block.children):
+                return False
+            block = block.children[index]
+        if move == 0:
+            block.rotate(1)
+        elif move == 1:
+            block.rotate(3)
+        elif move == 2:
+            block.swap(0)
+        elif move == 3:
+            block.swap(1)
+        elif move == 4:
+            if self.num_smashes >= HumanPlayer.MAX_SMASHES or \
+                    not block.smash(board.max_depth):
+                return False
+            self.num_smashes += 1
+        else:
+            return False
+        return True
+
+
+class GameSession:
+    """One game hosted by the server, played against one client.
+
+    === Public Attributes ===
+    game:
+        The game being played.  Its human players are RemotePlayers.
+    num_turns:
+        The number of turns each player gets.
+    moves:
+        The number of moves made so far, by all players.
+    """
+    game: Game
+    num_turns: int
+    moves: int
+    # === Private Attributes ===
+    # _reader:
+    #     The stream of messages from the client
+    # _writer:
+    #     The stream of messages to the client
+    # _board_sent:
+    #     True iff the whole board has been sent to the client, so that it
+    #     only needs the deltas since
+
+    def __init__(self, request: Dict, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        """Initialize this session for the client connected through <reader>
+        and <writer>, which asked for a game with the "new" message
+        <request>.
+        """
+        smart_players = request.get('smart_players', [2])
+        random_players = request.get('random_players', 0)
+        seed = request.get('seed')
+        rng = None if seed is None else game_rng(seed, 0)
+        num_players = 1 + random_players + len(smart_players)
+        self.game = Game(request.get('max_depth', 4), 1, random_players,
+                         smart_players, rng=rng,
+                         renderer=HeadlessRenderer(num_players),
+                         smart_budget=request.get('smart_budget'))
+        human = self.game.players[0]
+        self.game.players[0] = RemotePlayer(human.renderer, human.id,
+                                            human.goal)
+        self.num_turns = request.get('num_turns', 5)
+        self.moves = 0
+        self._reader = reader
+        self._writer = writer
+        self._board_sent = False
+        self.game.board.record_deltas()
+
+    async def play(self, executor: Optional[Executor]) -> None:
+        """Play this session's game to the end, running the computer
+        players' moves in <executor> (or the event loop's default executor
+        if <executor> is None).
+        """
+        loop = asyncio.get_running_loop()
+        players = self.game.players
+        for turn in range(self.num_turns * len(players)):
+            player = players[turn % len(players)]
+            if isinstance(player, RemotePlayer):
+                if not await self._remote_move(player):
+                    return
+            else:
+                await loop.run_in_executor(executor, player.make_move,
+                                           self.game.board)
+            self.moves += 1
+        await _send(self._writer, {'type': 'over',
+                                   'winner': self.game.winner(),
+                                   'moves': self.moves})
+
+    async def _remote_move(self, player: RemotePlayer) -> bool:
+        """Ask the client for a move until it sends one which can be made,
+        and make it.
+
+        Return False if the client quit or disconnected instead.
+        """
+        deltas = self.game.board.take_deltas()
+        if self._board_sent:
+            await _send(self._writer,
+                        {'type': 'your_move',
+                         'deltas': [delta.hex() for delta in deltas]})
+        else:
+            board = encode_board(self.game.board).hex()
+            await _send(self._writer, {'type': 'your_move', 'board': board})
+            self._board_sent = True
+        while True:
+            message = await _receive(self._reader)
+            if message is None or message.get('op') != 'move':
+                return False
+            error = _move_error(message)
+            if error is not None:
+                await _send(self._writer, {'type': 'error',
+                                           'message': error})
+                continue
+            made = player.apply_move(self.game.board,
+                                     tuple(message.get('path', [])),
+                                     message['move'])
+            await _send(self._writer, {'type': 'moved', 'ok': made})
+            if made:
+                return True
+
+
+async def serve(host: str = '127.0.0.1', port: int = 8765,
+                executor: Optional[Executor] = None) -> asyncio.Server:
+    """Start a game server listening on <host> and <port>, and return it.
+
+    Computer players' moves run in <executor>, or in the event loop's
+    default executor if it is None.
+    """
+    async def handle_client(reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await _receive(reader)
+            if request is not None and request.get('op') == 'new':
+                error = _request_error(request)
+                if error is not None:
+                    await _send(writer, {'type': 'error', 'message': error})
+                else:
+                    await GameSession(request, reader, writer).play(executor)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_client, host, port)
+
+
+def _is_int(value: object) -> bool:
+    """Return True iff <value>, decoded from JSON, is an integer.
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _request_error(request: Dict) -> Optional[str]:
+    """Return what is wrong with the "new" message <request>, or None if
+    every field it has is of the right type and in range.
+    """
+    max_depth = request.get('max_depth', 4)
+    if not _is_int(max_depth) or not 2 <= max_depth <= 5:
+        return '"max_depth" must be an integer from 2 to 5'
+    random_players = request.get('random_players', 0)
+    if not _is_int(random_players) or random_players < 0:
+        return '"random_players" must be a non-negative integer'
+    smart_players = request.get('smart_players', [2])
+    if not isinstance(smart_players, list) or \
+            not all(_is_int(difficulty) and difficulty >= 0
+                    for difficulty in smart_players):
+        return '"smart_players" must be a list of non-negative integers'
+    if 1 + random_players + len(smart_players) > MAX_PLAYERS:
+        return f'a game may have at most {MAX_PLAYERS} players'
+    num_turns = request.get('num_turns', 5)
+    if not _is_int(num_turns) or num_turns < 1:
+        return '"num_turns" must be a positive integer'
+    seed = request.get('seed')
+    if seed is not None and not _is_int(seed):
+        return '"seed" must be an integer'
+    smart_budget = request.get('smart_budget')
+    if smart_budget is not None and (
+            not (_is_int(smart_budget) or isinstance(smart_budget, float))
+            or not 0 < smart_budget <= MAX_SMART_BUDGET):
+        return f'"smart_budget" must be a number of seconds above 0 and ' \
+               f'at most {MAX_SMART_BUDGET}'
+    return None
+
+
+def _move_error(message: Dict) -> Optional[str]:
+    """Return what is wrong with the "move" message <message>, or None if
+    its fields are of the right type and in range.
+    """
+    path = message.get('path', [])
+    if not isinstance(path, list) or \
+            not all(_is_int(index) and 0 <= index <= 3 for index in path):
+        return '"path" must be a list of integers from 0 to 3'
+    move = message.get('move')
+    if not _is_int(move) or not 0 <= move <= 4:
+        return '"move" must be an integer from 0 to 4'
+    return None
+
+
+async def _send(writer: asyncio.StreamWriter, message: Dict) -> None:
+    """Send <message> through <writer>.
+    """
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+
+async def _receive(reader: asyncio.StreamReader) -> Optional[Dict]:
+    """Return the next message from <reader>, or None if the other side
+    has disconnected.
+
+    Raise ValueError if the message is not a JSON object.
+    """
+    line = await reader.readline()
+    if line == b'':
+        return None
+    message = json.loads(line)
+    if not isinstance(message, dict):
+        raise ValueError('a message must be a JSON object')
+    return message
+
+
+async def _simulated_client(host: str, port: int, request: Dict,
+                            rng: random.Random,
+                            latencies: List[float]) -> int:
+    """Play one game on the server at <host> and <port> as a client making
+    random rotations and swaps, and return the number of moves made in the
+    game by all players.
+
+    Append the time between sending each move and hearing that it was made
+    to <latencies>.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    board = None
+    try:
+        await _send(writer, request)
+        while True:
+            message = await _receive(reader)
+            if message is None:
+                return 0
+            if message['type'] == 'over':
+                return message['moves']
+            if 'board' in message:
+                board = decode_board(bytes.fromhex(message['board']))
+            else:
+                for delta in message['deltas']:
+                    apply_delta(board, bytes.fromhex(delta))
+            path = []
+            block = board
+            while block.children != [] and rng.random() < 0.6:
+                path.append(rng.randint(0, 3))
+                block = block.children[path[-1]]
+            start = time.perf_counter()
+            await _send(writer, {'op': 'move', 'path': path,
+                                 'move': rng.randint(0, 3)})
+            await _receive(reader)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def run_load(host: str, port: int, num_clients: int,
+                   games_per_client: int, request: Dict,
+                   seed: int = 0) -> Dict[str, float]:
+    """Play <games_per_client> games at once from each of <num_clients>
+    simulated clients against the server at <host> and <port>, asking for
+    games with the "new" message <request>.
+
+    Return the number of moves made per second, by all players in all
+    games, and the median and 99th percentile of the time the server took
+    to answer the clients' moves, in seconds.
+    """
+    latencies = []
+
+    async def client(number: int) -> int:
+        moves = 0
+        for game in range(games_per_client):
+            rng = game_rng(seed, number * games_per_client + game)
+            moves += await _simulated_client(host, port, request, rng,
+                                             latencies)
+        return moves
+
+    start = time.perf_counter()
+    moves = await asyncio.gather(*[client(i) for i in range(num_clients)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    if latencies == []:
+        latencies = [0.0]
+    return {'moves_per_second': sum(moves) / elapsed,
+            'p50_latency': latencies[len(latencies) // 2],
+            'p99_latency': latencies[min(int(len(latencies) * 0.99),
+                                         len(latencies) - 1)]}
+
+
+async def _load_test(args: argparse.Namespace) -> None:
+    """Run the load generator as asked for on the command line, starting a
+    server in this process if no port was given.
+    """
+    server = None
+    port = args.port
+    if port is None:
+        server = await serve(args.host, 0,
+                             ThreadPoolExecutor(args.workers))
+        port = server.sockets[0].getsockname()[1]
+    request = {'op': 'new', 'max_depth': args.max_depth,
+               'smart_players': args.smart_players,
+               'num_turns': args.num_turns}
+    print(await run_load(args.host, port, args.clients, args.games, request))
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+
+async def _serve_forever(args: argparse.Namespace) -> None:
+    """Run a game server as asked for on the command line.
+    """
+    server = await serve(args.host, args.port,
+                         ThreadPoolExecutor(args.workers))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host games of Blocky.')
+    parser.add_argument('mode', choices=['serve', 'load'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='threads for computer players\' moves')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--games', type=int, default=5,
+                        help='games per simulated client')
+    parser.add_argument('--max-depth', type=int, default=4)
+    parser.add_argument('--smart-players', type=int, nargs='*', default=[2])
+    parser.add_argument('--num-turns', type=int, default=5)
+    arguments = parser.parse_args()
+    if arguments.mode == 'serve':
+        if arguments.port is None:
+            arguments.port = 8765
+        asyncio.run(_serve_forever(arguments))
+    else:
+        asyncio.run(_load_test(arguments))
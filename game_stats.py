@@ -24,12 +24,16 @@ At the bottom of the file, there are some function that you
 can call to try playing the game in several different configurations.
 """
 import random
-from typing import List, Tuple
-from block import Block, random_init
+from typing import List, Optional, Tuple, TYPE_CHECKING
+from block import Block, random_init, random_board
 from goal import BlobGoal, PerimeterGoal
-from player_stats import Player, HumanPlayer, RandomPlayer, SmartPlayer
+from player_stats import Player, HumanPlayer, RandomPlayer, SmartPlayer, \
+    SearchPlayer
 from renderer import Renderer, COLOUR_LIST, colour_name, BOARD_WIDTH
 
+if TYPE_CHECKING:
+    from stats_collection import GameAggregator
+
 
 class Game:
     """A game of Blocky.
@@ -53,44 +57,92 @@ class Game:
     def __init__(self, max_depth: int,
                  num_human: int,
                  random_players: int,
-                 smart_players: List[int]) -> None:
+                 smart_players: List[int],
+                 search_players: Optional[List[float]] = None,
+                 rng: Optional[random.Random] = None,
+                 renderer: Optional[Renderer] = None,
+                 goal_type: Optional[type] = None,
+                 smart_budget: Optional[float] = None) -> None:
         """Initialize this game, as described in the Assignment 2 handout.
 
+        <search_players> holds the time budget, in seconds per move, of each
+        SearchPlayer to add after the smart players.
+
+        If <rng> is given, it alone decides the goal type, the goal colours
+        and the board, using random_board, so that the game can be
+        reproduced from it.  Otherwise the random module is used.
+
+        If <renderer> is None, the game is drawn in a new pygame window by a
+        Renderer.  Pass a HeadlessRenderer to play without a window.
+
+        If <goal_type> is None, every player gets a BlobGoal or every player
+        gets a PerimeterGoal, at random.  Otherwise every player gets a goal
+        of <goal_type>, and the board and colours are the same as they would
+        have been with a random goal type.
+
+        If <smart_budget> is given, every SmartPlayer may spend that many
+        seconds on each move, considering as many moves as it can score in
+        that time, instead of a number of moves set by its difficulty.
+
         Precondition:
             2 <= max_depth <= 5
         """
-        num_players = num_human + random_players + len(smart_players)
-        self.renderer = Renderer(num_players)
-        goal_type = [BlobGoal, PerimeterGoal][random.randint(0, 1)]
+        if search_players is None:
+            search_players = []
+        num_players = num_human + random_players + len(smart_players) + \
+            len(search_players)
+        if renderer is None:
+            renderer = Renderer(num_players)
+        self.renderer = renderer
+        chooser = random if rng is None else rng
+        random_goal_type = [BlobGoal, PerimeterGoal][chooser.randint(0, 1)]
+        if goal_type is None:
+            goal_type = random_goal_type
         self.players = []
         player_id = 0
         for _ in range(num_human):
             # Make human players
-            colour = COLOUR_LIST[random.randint(0, 3)]
+            colour = COLOUR_LIST[chooser.randint(0, 3)]
             goal = goal_type(colour)
             self.players.append(HumanPlayer(self.renderer, player_id, goal))
             #self.renderer.display_goal(self.players[-1])
             player_id += 1
         for _ in range(random_players):
             # Make random players
-            colour = COLOUR_LIST[random.randint(0, 3)]
+            colour = COLOUR_LIST[chooser.randint(0, 3)]
             goal = goal_type(colour)
             self.players.append(RandomPlayer(self.renderer, player_id, goal))
             #self.renderer.display_goal(self.players[-1])
             player_id += 1
         for difficulty in smart_players:
             # Make smart players
-            colour = COLOUR_LIST[random.randint(0, 3)]
+            colour = COLOUR_LIST[chooser.randint(0, 3)]
             goal = goal_type(colour)
             self.players.append(SmartPlayer(self.renderer, player_id, goal,
-                                            difficulty))
+                                            difficulty, smart_budget))
+            #self.renderer.display_goal(self.players[-1])
+            player_id += 1
+        for time_budget in search_players:
+            # Make search players
+            colour = COLOUR_LIST[chooser.randint(0, 3)]
+            goal = goal_type(colour)
+            self.players.append(SearchPlayer(self.renderer, player_id, goal,
+                                             time_budget))
             #self.renderer.display_goal(self.players[-1])
             player_id += 1
-        self.board = random_init(0, max_depth)
+        for player in self.players:
+            if isinstance(player, SearchPlayer):
+                player.set_opponents([other.goal for other in self.players
+                                      if other is not player])
+        if rng is None:
+            self.board = random_init(0, max_depth)
+        else:
+            self.board = random_board(max_depth, rng)
         self.board.update_block_locations((0, 0), BOARD_WIDTH)
         #self.renderer.draw(self.board, 0)
 
-    def run_game(self, num_turns: int) -> int:
+    def run_game(self, num_turns: int,
+                 aggregator: Optional['GameAggregator'] = None) -> int:
         """Run the game for the number of turns specified.
 
         Each player gets <num_turns> turns. The first player in self.players
@@ -103,6 +155,8 @@ class Game:
 
         When the game is over, print who won to the console.
 
+        If <aggregator> is given, record every player's score after each
+        move, and the final scores and winner, in it.
         """
         # Index within self.players of the current player.
         index = 0
@@ -115,7 +169,25 @@ class Game:
                 #print(f'Player {player.id} CURRENT SCORE: ' +
                  #     f'{player.goal.score(self.board)}')
                 index = (index + 1) % len(self.players)
+                if aggregator is not None:
+                    aggregator.record_turn(turn, self.scores())
 
+        winner = self.winner()
+        if aggregator is not None:
+            aggregator.record_game(type(self.players[0].goal).__name__,
+                                   self.scores(), winner)
+        return winner
+
+    def scores(self) -> List[int]:
+        """Return the current score of each player in self.players.
+        """
+        return [player.goal.score(self.board) for player in self.players]
+
+    def winner(self) -> int:
+        """Return the index within self.players of the player with the
+        highest score on the current board, favouring earlier players in
+        case of a tie.
+        """
         # Determine and report the winner.
         max_score = 0
         winning_player = 0
@@ -158,6 +230,15 @@ def solitaire_game() -> None:
     game.run_game(30)
 
 
+def search_game() -> None:
+    """Run a game between a smart player and a search player which may
+    think for half a second per move.
+    """
+    random.seed(1001)
+    game = Game(4, 0, 0, [6], [0.5])
+    game.run_game(10)
+
+
 def sample_game() -> None:
     """Run a sample game with one human player, one random player,
     and one smart player.
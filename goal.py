@@ -11,9 +11,310 @@ University of Toronto
 This file contains the Goal class hierarchy.
 """
 
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
+from weakref import WeakKeyDictionary, ref
 from block import Block
-from renderer import colour_name
+from bitboard import Bitboard, from_block
+from renderer import COLOUR_LIST, colour_name
+
+
+class ScoreContext:
+    """A snapshot of one version of a board, shared by every goal which
+    scores that version, so that the board is only flattened once.
+
+    === Public Attributes ===
+    version:
+        The version of the board this snapshot was taken at.
+    """
+    version: int
+    # === Private Attributes ===
+    # _board:
+    #     A weak reference to the board this snapshot was taken of.  It must
+    #     be weak, since _CONTEXTS only drops a context once nothing else
+    #     refers to its board.
+    # _grid:
+    #     The flattened board, or None if it has not been needed yet
+    # _analysis:
+    #     The ColourAnalysis of grid, or None if it has not been needed yet
+    # _bitboard:
+    #     The Bitboard of board, or None if it has not been needed yet
+    # _regions:
+    #     The RegionAnalysis of board, or None if it has not been needed yet
+    # _areas:
+    #     Maps each colour on board to its number of unit cells, or None if
+    #     it has not been needed yet
+    _board: 'ref[Block]'
+    _grid: Optional[List[List[Tuple[int, int, int]]]]
+    _analysis: Optional['ColourAnalysis']
+    _bitboard: Optional[Bitboard]
+    _regions: Optional['RegionAnalysis']
+    _areas: Optional[Dict[Tuple[int, int, int], int]]
+
+    def __init__(self, board: Block) -> None:
+        """Initialize this context with a snapshot of the current version
+        of <board>.
+        """
+        self._board = ref(board)
+        self.version = board.version
+        self._grid = None
+        self._analysis = None
+        self._bitboard = None
+        self._regions = None
+        self._areas = None
+
+    @property
+    def board(self) -> Block:
+        """The board this snapshot was taken of.
+        """
+        return self._board()
+
+    @property
+    def grid(self) -> List[List[Tuple[int, int, int]]]:
+        """The flattened board, as returned by Block.flatten, flattened the
+        first time it is asked for.  It is shared between goals, and must
+        not be mutated.
+        """
+        if self._grid is None:
+            self._grid = self.board.flatten()
+        return self._grid
+
+    def analysis(self) -> 'ColourAnalysis':
+        """Return the ColourAnalysis of this version of the board, computing
+        it the first time it is asked for.
+        """
+        if self._analysis is None:
+            self._analysis = ColourAnalysis(self.grid)
+        return self._analysis
+
+    def bitboard(self) -> Bitboard:
+        """Return the Bitboard of this version of the board, building it
+        the first time it is asked for.
+        """
+        if self._bitboard is None:
+            self._bitboard = from_block(self.board)
+        return self._bitboard
+
+    def regions(self) -> 'RegionAnalysis':
+        """Return the RegionAnalysis of this version of the board, computing
+        it the first time it is asked for.
+        """
+        if self._regions is None:
+            self._regions = RegionAnalysis(self.board)
+        return self._regions
+
+    def colour_areas(self) -> Dict[Tuple[int, int, int], int]:
+        """Return a dict mapping each colour on this version of the board to
+        its number of unit cells, counting them the first time it is asked
+        for.  Only undivided blocks are visited.
+        """
+        if self._areas is None:
+            board = self.board
+            self._areas = {}
+            stack = [(board, 4**(board.max_depth - board.level))]
+            while stack:
+                block, cells = stack.pop()
+                if len(block.children) == 0:
+                    self._areas[block.colour] = \
+                        self._areas.get(block.colour, 0) + cells
+                else:
+                    stack.extend((child, cells // 4)
+                                 for child in block.children)
+        return self._areas
+
+
+class ColourAnalysis:
+    """The largest blob and the perimeter count of every colour in
+    COLOUR_LIST on a flattened board, found in a single labelling pass.
+
+    === Public Attributes ===
+    blob_sizes:
+        Maps each colour to the size of its largest connected blob.
+    perimeters:
+        Maps each colour to the number of unit cells of that colour on the
+        perimeter, with corner cells counted twice.
+    """
+    blob_sizes: Dict[Tuple[int, int, int], int]
+    perimeters: Dict[Tuple[int, int, int], int]
+
+    def __init__(self, grid: List[List[Tuple[int, int, int]]]) -> None:
+        """Initialize this analysis of the flattened board <grid>.
+
+        Every cell is labelled exactly once: an unlabelled cell starts a
+        flood fill of its own colour, which labels the whole blob.
+        """
+        self.blob_sizes = {colour: 0 for colour in COLOUR_LIST}
+        self.perimeters = {colour: 0 for colour in COLOUR_LIST}
+        width = len(grid)
+        last = width - 1
+        labelled = [[False] * width for _ in range(width)]
+        for x in range(width):
+            for y in range(width):
+                colour = grid[x][y]
+                # Corner cells lie on two sides of the perimeter
+                sides = (x == 0) + (x == last) + (y == 0) + (y == last)
+                if sides > 0:
+                    self.perimeters[colour] = \
+                        self.perimeters.get(colour, 0) + sides
+                if labelled[x][y]:
+                    continue
+                labelled[x][y] = True
+                size = 0
+                stack = [(x, y)]
+                while stack:
+                    i, j = stack.pop()
+                    size += 1
+                    for a, b in ((i + 1, j), (i - 1, j),
+                                 (i, j + 1), (i, j - 1)):
+                        if 0 <= a < width and 0 <= b < width and \
+                                not labelled[a][b] and grid[a][b] == colour:
+                            labelled[a][b] = True
+                            stack.append((a, b))
+                if size > self.blob_sizes.get(colour, 0):
+                    self.blob_sizes[colour] = size
+
+
+class RegionAnalysis:
+    """The largest blob of every colour in COLOUR_LIST on a board, found
+    from its undivided blocks without flattening it.
+
+    === Public Attributes ===
+    blob_sizes:
+        Maps each colour to the size of its largest connected blob, in unit
+        cells.
+    """
+    blob_sizes: Dict[Tuple[int, int, int], int]
+    # === Private Attributes ===
+    # _colours:
+    #     The colour of each undivided block, numbered in the order found
+    # _parents:
+    #     The union-find parent of each undivided block
+    # _areas:
+    #     For each undivided block which is the root of its set, the number
+    #     of unit cells in the set
+    _colours: List[Tuple[int, int, int]]
+    _parents: List[int]
+    _areas: List[int]
+
+    def __init__(self, board: Block) -> None:
+        """Initialize this analysis of <board>.
+
+        Each undivided block is a region of 4^(max_depth - level) unit
+        cells.  Working up from the leaves, each block lists the regions
+        along its four edges, and the regions facing each other across the
+        seams between its children are joined if they have the same colour.
+        The cost follows the number of undivided blocks, not unit cells.
+        """
+        self._colours = []
+        self._parents = []
+        self._areas = []
+        self._edges(board, 2**(board.max_depth - board.level))
+        self.blob_sizes = {colour: 0 for colour in COLOUR_LIST}
+        for region, colour in enumerate(self._colours):
+            if self._parents[region] == region and \
+                    self._areas[region] > self.blob_sizes.get(colour, 0):
+                self.blob_sizes[colour] = self._areas[region]
+
+    def _edges(self, block: Block, width: int) \
+            -> Tuple[List[Tuple[int, int]], ...]:
+        """Number the undivided blocks within <block>, which is <width> unit
+        cells across, and join the same-coloured ones which touch.
+
+        Return the regions along its top, bottom, left and right edges, in
+        order from the top left, as (region, length in unit cells) pairs.
+        """
+        if len(block.children) == 0:
+            region = len(self._colours)
+            self._colours.append(block.colour)
+            self._parents.append(region)
+            self._areas.append(width * width)
+            edge = [(region, width)]
+            return edge, edge, edge, edge
+        half = width // 2
+        upper_right, upper_left, lower_left, lower_right = \
+            [self._edges(child, half) for child in block.children]
+        self._join(upper_left[3], upper_right[2])
+        self._join(lower_left[3], lower_right[2])
+        self._join(upper_left[1], lower_left[0])
+        self._join(upper_right[1], lower_right[0])
+        return (upper_left[0] + upper_right[0],
+                lower_left[1] + lower_right[1],
+                upper_left[2] + lower_left[2],
+                upper_right[3] + lower_right[3])
+
+    def _join(self, first: List[Tuple[int, int]],
+              second: List[Tuple[int, int]]) -> None:
+        """Join the same-coloured regions facing each other across a seam,
+        where <first> and <second> list the regions along each side of it,
+        as returned by _edges.
+        """
+        i = 0
+        j = 0
+        first_end = first[0][1]
+        second_end = second[0][1]
+        while True:
+            a = first[i][0]
+            b = second[j][0]
+            if self._colours[a] == self._colours[b]:
+                self._union(a, b)
+            # Move past whichever region ends first, or both if they end
+            # together
+            if first_end == second_end:
+                i += 1
+                j += 1
+                if i == len(first):
+                    return
+                first_end += first[i][1]
+                second_end += second[j][1]
+            elif first_end < second_end:
+                i += 1
+                first_end += first[i][1]
+            else:
+                j += 1
+                second_end += second[j][1]
+
+    def _union(self, a: int, b: int) -> None:
+        """Join the sets of regions <a> and <b>, if they are different.
+        """
+        a = self._find(a)
+        b = self._find(b)
+        if a != b:
+            if self._areas[a] < self._areas[b]:
+                a, b = b, a
+            self._parents[b] = a
+            self._areas[a] += self._areas[b]
+
+    def _find(self, region: int) -> int:
+        """Return the region at the root of the set containing <region>.
+        """
+        parents = self._parents
+        while parents[region] != region:
+            parents[region] = parents[parents[region]]
+            region = parents[region]
+        return region
+
+
+def analyse_colours(board: Block) -> ColourAnalysis:
+    """Return the largest blob and perimeter count of every colour on the
+    current version of <board>, sharing the work with every goal which
+    scores this version through its ScoreContext.
+    """
+    return score_context(board).analysis()
+
+
+# The most recent ScoreContext of each board which has been scored.
+# Boards which are no longer used are dropped automatically.
+_CONTEXTS = WeakKeyDictionary()
+
+
+def score_context(board: Block) -> ScoreContext:
+    """Return the ScoreContext for the current version of <board>, creating
+    it only if <board> has changed since its last snapshot.
+    """
+    context = _CONTEXTS.get(board)
+    if context is None or context.version != board.version:
+        context = ScoreContext(board)
+        _CONTEXTS[board] = context
+    return context
 
 
 class Goal:
@@ -40,6 +341,45 @@ class Goal:
         """
         raise NotImplementedError
 
+    def score_analysis(self, analysis: ColourAnalysis) -> int:
+        """Return the score for this goal on the board described by
+        <analysis>.
+
+        This gives the same result as score, and lets several goals be
+        scored from one ColourAnalysis.
+        """
+        raise NotImplementedError
+
+    def score_bitboard(self, bitboard: Bitboard) -> int:
+        """Return the score for this goal on the board stored in <bitboard>.
+
+        This gives the same result as score, using whole-row bit operations
+        instead of visiting each unit cell.
+        """
+        raise NotImplementedError
+
+    def area(self, board: Block) -> int:
+        """Return the number of unit cells of this goal's colour on <board>.
+
+        Rotations and swaps never change it, so it can be found once and
+        passed to upper_bound for every move considered on <board>.
+        """
+        return score_context(board).colour_areas().get(self.colour, 0)
+
+    def upper_bound(self, board: Block, block: Block, score: int,
+                    area: int) -> int:
+        """Return a bound on the score for this goal on <board> after any
+        rotation or swap of <block>, which is within <board>.  <score> is
+        the current score for this goal on <board>, and <area> is
+        self.area(board).
+
+        The bound is never less than the score any such move gives, and is
+        cheaper to find than scoring the board after the move, so moves
+        which cannot beat a known score need not be scored.  If <block> is
+        <board>, the bound holds for a move of any Block within <board>.
+        """
+        raise NotImplementedError
+
     def description(self) -> str:
         """Return a description of this goal.
         """
@@ -110,9 +450,22 @@ class BlobGoal(Goal):
         """Return the current score for this goal on the given board.
 
         The score is always greater than or equal to 0.
+
+        The blobs are found by joining neighbouring undivided blocks, as
+        described in RegionAnalysis, without flattening the board.  The
+        result is shared with every goal which scores the same version of
+        the board.
+        """
+        return score_context(board).regions().blob_sizes.get(self.colour, 0)
+
+    def score_grid(self, board: Block) -> int:
+        """Return the current score for this goal on the given board, by
+        visiting every unit cell of the flattened board.
+
+        This gives the same result as score, much more slowly.
         """
         max_blob = 0
-        flattened = board.flatten()
+        flattened = score_context(board).grid
         visited = [[-1 for _ in range(2**board.max_depth)] \
                    for _ in range(2**board.max_depth)]
         for x in range(len(visited)):
@@ -123,6 +476,31 @@ class BlobGoal(Goal):
                     max_blob = max(max_blob, temp)
         return max_blob
 
+    def score_analysis(self, analysis: ColourAnalysis) -> int:
+        """Return the score for this goal on the board described by
+        <analysis>.
+        """
+        return analysis.blob_sizes.get(self.colour, 0)
+
+    def score_bitboard(self, bitboard: Bitboard) -> int:
+        """Return the score for this goal on the board stored in <bitboard>.
+        """
+        return bitboard.largest_blob(self.colour)
+
+    def upper_bound(self, board: Block, block: Block, score: int,
+                    area: int) -> int:
+        """Return a bound on the score for this goal on <board> after any
+        rotation or swap of <block>, which is within <board>.  <score> is
+        the current score for this goal on <board>, and <area> is
+        self.area(board).
+
+        Moving an undivided block changes nothing.  Otherwise, no blob is
+        larger than <area>.
+        """
+        if len(block.children) == 0:
+            return score
+        return area
+
     def description(self) -> str:
         """Return a description of this goal.
         """
@@ -138,21 +516,88 @@ class PerimeterGoal(Goal):
         """Return the current score for this goal on the given board.
 
         The score is always greater than or equal to 0.
+
+        The board is not flattened.  Only the blocks touching its edges are
+        visited, and each undivided one of this goal's colour adds its
+        width in unit cells once for every edge it lies on, so corner cells
+        are counted twice.  The cost grows with the perimeter of the board,
+        not its area.
+        """
+        return self._edge_count(board, 2**(board.max_depth - board.level),
+                                1, 1, 1, 1)
+
+    def upper_bound(self, board: Block, block: Block, score: int,
+                    area: int) -> int:
+        """Return a bound on the score for this goal on <board> after any
+        rotation or swap of <block>, which is within <board>.  <score> is
+        the current score for this goal on <board>, and <area> is
+        self.area(board).
+
+        Only the unit cells of <block> which lie on the edges of <board> can
+        change the score, so a move within a block that does not touch the
+        edges changes nothing.  Otherwise the block's current share of the
+        score is replaced by the most it could have: its width, or <area>
+        if that is less, on every edge it lies on.
+        """
+        if len(block.children) == 0:
+            return score
+        top = bottom = left = right = 1
+        child = block
+        while child is not board:
+            i = child.parent.children.index(child)
+            top &= i in (0, 1)
+            bottom &= i in (2, 3)
+            left &= i in (1, 2)
+            right &= i in (0, 3)
+            child = child.parent
+        sides = top + bottom + left + right
+        if sides == 0:
+            return score
+        width = 2**(block.max_depth - block.level)
+        return score - self._edge_count(block, width, top, bottom, left,
+                                        right) + sides * min(width, area)
+
+    def _edge_count(self, block: Block, width: int, top: int, bottom: int,
+                    left: int, right: int) -> int:
+        """Return the number of unit cells of this goal's colour in <block>
+        on the edges of the board, counting corner cells twice.  <block> is
+        <width> unit cells across, and <top>, <bottom>, <left> and <right>
+        are 1 if it lies on that edge of the board and 0 if not.
         """
-        flattened = board.flatten()
         count = 0
-        for x in range(len(flattened)):
-            if flattened[x][0] == self.colour:
-                count += 1
-            if flattened[x][-1] == self.colour:
-                count += 1
-        for y in range(len(flattened)):
-            if flattened[0][y] == self.colour:
-                count += 1
-            if flattened[-1][y] == self.colour:
-                count += 1
+        # The blocks still to visit, with their width in unit cells and
+        # whether they lie on the top, bottom, left and right edges
+        stack = [(block, width, top, bottom, left, right)]
+        while stack:
+            block, width, top, bottom, left, right = stack.pop()
+            if len(block.children) == 0:
+                if block.colour == self.colour:
+                    count += width * (top + bottom + left + right)
+                continue
+            half = width // 2
+            upper_right, upper_left, lower_left, lower_right = \
+                block.children
+            if top or right:
+                stack.append((upper_right, half, top, 0, 0, right))
+            if top or left:
+                stack.append((upper_left, half, top, 0, left, 0))
+            if bottom or left:
+                stack.append((lower_left, half, 0, bottom, left, 0))
+            if bottom or right:
+                stack.append((lower_right, half, 0, bottom, 0, right))
         return count
 
+    def score_analysis(self, analysis: ColourAnalysis) -> int:
+        """Return the score for this goal on the board described by
+        <analysis>.
+        """
+        return analysis.perimeters.get(self.colour, 0)
+
+    def score_bitboard(self, bitboard: Bitboard) -> int:
+        """Return the score for this goal on the board stored in <bitboard>.
+        """
+        return bitboard.perimeter(self.colour)
+
     def description(self) -> str:
         """Return a description of this goal.
         """
@@ -165,7 +610,7 @@ if __name__ == '__main__':
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing',
-            'block', 'goal', 'player', 'renderer'
+            'block', 'goal', 'player', 'renderer', 'weakref', 'bitboard'
         ],
         'max-attributes': 15
     })
@@ -12,15 +12,36 @@ This file contains the player class hierarchy.
 """
 
 import random
-from typing import Optional
-import pygame
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple, TYPE_CHECKING
 from renderer import Renderer
-from block import Block
+from block import Block, encode_board
 from goal import Goal
 
+# Only HumanPlayer needs pygame, so it is imported when a HumanPlayer
+# handles input.  Computer players never load it.
+if TYPE_CHECKING:
+    import pygame
+
 # THIS IS NOT THE RIGHT TIME, I'M DOING IT FOR SPEED
 TIME_DELAY = 0
 
+# The move code undoing each of the move codes used by _move_smart
+_ANTIMOVES = [1, 0, 2, 3]
+
+# Bounds on the values a SearchPlayer can give a board, and the flags
+# recording which kind of value is stored in its transposition table
+_WIN = 2 ** 31
+_LOSS = -_WIN
+_EXACT = 0
+_LOWER = 1
+_UPPER = 2
+
+# A move stored in a SearchPlayer's transposition table: the path from the
+# board to the block moved, as returned by Block.path, and the move code
+_Move = Tuple[Tuple[int, ...], int]
+
 
 class Player:
     """A player in the Blocky game.
@@ -65,8 +86,12 @@ class HumanPlayer(Player):
     === Public Attributes ===
     num_smashes:
         number of smashes which this HumanPlayer has performed
+    frame_cap:
+        the largest number of times per second the board is redrawn
+        while this HumanPlayer chooses a move
     === Representation Invariants ===
     num_smashes >= 0
+    frame_cap > 0
     """
     # === Private Attributes ===
     # _selected_block
@@ -82,16 +107,22 @@ class HumanPlayer(Player):
     # The total number of 'smash' moves a HumanPlayer can make during a game.
     MAX_SMASHES = 1
 
+    # The default number of times per second the board may be redrawn.
+    FRAME_CAP = 60
+
     num_smashes: int
+    frame_cap: int
     _selected_block: Optional[Block]
     _level: int
 
-    def __init__(self, renderer: Renderer, player_id: int, goal: Goal) -> None:
-        """Initialize this HumanPlayer with the given <renderer>, <player_id>
-        and <goal>.
+    def __init__(self, renderer: Renderer, player_id: int, goal: Goal,
+                 frame_cap: int = FRAME_CAP) -> None:
+        """Initialize this HumanPlayer with the given <renderer>, <player_id>,
+        <goal> and <frame_cap>.
         """
         super().__init__(renderer, player_id, goal)
         self.num_smashes = 0
+        self.frame_cap = frame_cap
 
         # This HumanPlayer has done no smashes yet.
         # This HumanPlayer has not yet selected a block, so set _level to 0
@@ -100,7 +131,7 @@ class HumanPlayer(Player):
         self._selected_block = None
 
     def process_event(self, board: Block,
-                      event: pygame.event.Event) -> Optional[int]:
+                      event: 'pygame.event.Event') -> Optional[int]:
         """Process the given pygame <event>.
 
         Identify the selected block and mark it as highlighted.  Then identify
@@ -116,8 +147,9 @@ class HumanPlayer(Player):
              trying to smash in an invalid location or when the player is not
              allowed further smashes).
         """
+        import pygame
         # Get the new "selected" block from the position of the cursor
-        block = board.get_selected_block(pygame.mouse.get_pos(), self._level)
+        block = board.pick_block(pygame.mouse.get_pos(), self._level)
 
         # Remove the highlighting from the old "_selected_block"
         # before highlighting the new one
@@ -173,6 +205,7 @@ class HumanPlayer(Player):
 
         This method will hold focus until a valid move is performed.
         """
+        import pygame
         self._level = 0
         self._selected_block = board
 
@@ -181,32 +214,59 @@ class HumanPlayer(Player):
         pygame.event.clear()
 
         # Keep checking the moves performed by the player until a valid move
-        # has been completed. Draw the board on every loop to draw the
-        # selected block properly on screen.
+        # has been completed. Sleep until there are events to handle, and
+        # only redraw the board when they change it or the selected block,
+        # at most frame_cap times a second.
+        clock = pygame.time.Clock()
+        self.renderer.draw(board, self.id)
         while True:
-            self.renderer.draw(board, self.id)
-            # loop through all of the events within the event queue
+            # wait for the next event, then take every other pending one
             # (all pending events from the user input)
-            for event in pygame.event.get():
+            events = [pygame.event.wait()] + pygame.event.get()
+            redraw = False
+            for event in events:
                 if event.type == pygame.QUIT:
                     return 1
+                elif event.type == pygame.VIDEOEXPOSE:
+                    # The window was uncovered and needs repainting
+                    redraw = True
+                    continue
 
+                selected = self._selected_block
                 result = self.process_event(board, event)
-                self.renderer.draw(board, self.id)
                 if result is not None and result > 0:
+                    self.renderer.draw(board, self.id)
                     # un-highlight the selected block
                     self._selected_block.highlighted = False
                     return 0
+                if result is not None or self._selected_block is not selected:
+                    redraw = True
+
+            if redraw:
+                self.renderer.draw(board, self.id)
+                clock.tick(self.frame_cap)
 
 class RandomPlayer(Player):
     """A random player, who makes random moves with random blocks on the board.
     RandomPlayer is not the most formidable of opponents, at least not
     on average.
+
+    === Public Attributes ===
+    level_weights:
+        None if blocks are chosen by descending the board at random, as
+        _random_block does.  Otherwise blocks are drawn from the board's
+        BlockIndex in constant time, choosing level i with probability
+        proportional to level_weights[i] and then a block of that level
+        uniformly.
     """
-    def __init__(self, renderer: Renderer, player_id: int, goal: Goal) -> None:
+    level_weights: Optional[List[float]]
+
+    def __init__(self, renderer: Renderer, player_id: int, goal: Goal,
+                 level_weights: Optional[List[float]] = None) -> None:
         """ Initializes an instance of class RandomPlayer
         """
         Player.__init__(self, renderer, player_id, goal)
+        self.level_weights = level_weights
 
     def make_move(self, board: Block) -> int:
         """ Makes a random move for RandomPlayer
@@ -215,7 +275,11 @@ class RandomPlayer(Player):
             _random_move(board)
             return 0
         else:
-            block = _random_block(board)
+            if self.level_weights is None:
+                block = _random_block(board)
+            else:
+                block = board.block_index().random_block(random,
+                                                         self.level_weights)
             block.highlighted = True
             #self.renderer.draw(board, self.id)
             #pygame.time.wait(TIME_DELAY)
@@ -229,27 +293,64 @@ class SmartPlayer(Player):
     calculating the best move from a random choice of them.
 
     However, a SmartPlayer cannot do smashes at all.
+
+    A SmartPlayer with a time budget considers random moves until its
+    budget for the move runs out, instead of a number of moves fixed by its
+    difficulty, so its moves never take much longer than the budget.
+
+    Moves whose Goal.upper_bound shows they cannot beat the best move so
+    far are skipped without being scored.
+
+    === Public Attributes ===
+    candidates_evaluated:
+        The number of moves scored while choosing the last move
+    candidates_pruned:
+        The number of moves skipped by their upper bound while choosing the
+        last move
     """
     # === Private Attributes ===
     #     _difficulty:
     #       The difficulty of this SmartPlayer
+    #     _time_budget:
+    #       The number of seconds this SmartPlayer may spend on a move, or
+    #       None if it considers a number of moves set by _difficulty
     #
     # === Representation Invariants == =
     #      difficulty >= 0
+    #      _time_budget is None or _time_budget >= 0
+    candidates_evaluated: int
+    candidates_pruned: int
     _difficulty: int
+    _time_budget: Optional[float]
     def __init__(self, renderer: Renderer, player_id: int, goal: Goal,
-                 diff: int) -> None:
-        """ Initializes an instance of class SmartPlayer
+                 diff: int, time_budget: Optional[float] = None) -> None:
+        """ Initializes an instance of class SmartPlayer. If <time_budget>
+        is given, the SmartPlayer may spend that many seconds on each move,
+        and <diff> is not used.
 
         === Precondition ===
         _difficulty >= 0
         """
         Player.__init__(self, renderer, player_id, goal)
         self._difficulty = diff
+        self._time_budget = time_budget
+        self.candidates_evaluated = 0
+        self.candidates_pruned = 0
+
+    def pruned_fraction(self) -> float:
+        """ Returns the fraction of the moves considered for the last move
+        which were skipped by their upper bound.
+        """
+        considered = self.candidates_evaluated + self.candidates_pruned
+        if considered == 0:
+            return 0.0
+        return self.candidates_pruned / considered
 
     def make_move(self, board: Block) -> int:
         """ Makes a random move for SmartPlayer.
         """
+        if self._time_budget is not None:
+            return self._make_move_by_deadline(board)
         possible_moves_to_consider = [5, 10, 25, 50, 100, 150]
         moves_to_consider = 0
         # Determines how many moves to consider
@@ -266,14 +367,26 @@ class SmartPlayer(Player):
         max = 0
         max_score = 0
         antimoves = [1, 0, 2, 3]
-
-        for i in range(len(moves)):
-            _move_smart(moves[i][0], moves[i][1])
-            if self.goal.score(board) > max_score:
-                max = i
-                max_score = self.goal.score(board)
-            # Undoes the prior move
-            _move_smart(moves[i][0], antimoves[moves[i][1]])
+        current_score = self.goal.score(board)
+        area = self.goal.area(board)
+        self.candidates_pruned = 0
+
+        # Trial moves are undone, so no deltas are recorded for them
+        with board.deltas_paused():
+            for i in range(len(moves)):
+                if self.goal.upper_bound(board, moves[i][0], current_score,
+                                         area) <= max_score:
+                    # This move cannot beat the best so far
+                    self.candidates_pruned += 1
+                    continue
+                _move_smart(moves[i][0], moves[i][1])
+                score = self.goal.score(board)
+                if score > max_score:
+                    max = i
+                    max_score = score
+                # Undoes the prior move
+                _move_smart(moves[i][0], antimoves[moves[i][1]])
+        self.candidates_evaluated = len(moves) - self.candidates_pruned
         # Doing the right move in moves
         moves[max][0].highlighted = True
         #self.renderer.draw(board, self.id)
@@ -283,6 +396,265 @@ class SmartPlayer(Player):
         #self.renderer.draw(board, self.id)
         return 0
 
+    def _make_move_by_deadline(self, board: Block) -> int:
+        """ Makes the best of the random moves SmartPlayer can score within
+        its time budget.
+
+        A best move is held from the start, so that the budget can run out
+        at any point: it is the first random move until a move scores
+        higher, as when moves are considered by difficulty.  No move is
+        scored once the slowest scoring so far would overrun the budget, and
+        the search stops early once no move at all can beat the best.
+        """
+        now = time.perf_counter()
+        deadline = now + self._time_budget
+        best = [_random_block(board), random.randint(0, 3)]
+        best_score = 0
+        current_score = self.goal.score(board)
+        area = self.goal.area(board)
+        # No move anywhere on the board can score more than this
+        ceiling = self.goal.upper_bound(board, board, current_score, area)
+        candidate = best
+        slowest = 0.0
+        self.candidates_evaluated = 0
+        self.candidates_pruned = 0
+        # Trial moves are undone, so no deltas are recorded for them
+        with board.deltas_paused():
+            while best_score < ceiling and now + slowest < deadline:
+                if self.goal.upper_bound(board, candidate[0], current_score,
+                                         area) <= best_score:
+                    # This move cannot beat the best so far
+                    self.candidates_pruned += 1
+                    candidate = [_random_block(board), random.randint(0, 3)]
+                    now = time.perf_counter()
+                    continue
+                _move_smart(candidate[0], candidate[1])
+                score = self.goal.score(board)
+                # Undoes the candidate move
+                _move_smart(candidate[0], _ANTIMOVES[candidate[1]])
+                self.candidates_evaluated += 1
+                if score > best_score:
+                    best = candidate
+                    best_score = score
+                candidate = [_random_block(board), random.randint(0, 3)]
+                start = now
+                now = time.perf_counter()
+                slowest = max(slowest, now - start)
+        # Doing the best move found
+        best[0].highlighted = True
+        _move_smart(best[0], best[1])
+        best[0].highlighted = False
+        return 0
+
+class SearchPlayer(Player):
+    """ A search player, which looks several moves ahead instead of one.
+
+    A SearchPlayer runs an iterative deepening minimax search over rotations
+    and swaps, assuming that the opponents always answer with the move
+    that hurts it the most. Each position is valued as this player's score
+    minus the best score among the opponents. The search stops as soon as
+    the time budget for the move runs out, and the best move found so far
+    is played. Like a SmartPlayer, a SearchPlayer cannot do smashes.
+
+    === Public Attributes ===
+    nodes_searched:
+        The number of positions visited while choosing the last move
+    search_time:
+        The number of seconds spent choosing the last move
+    depth_reached:
+        The deepest search which was completed for the last move
+    """
+    # === Private Attributes ===
+    #     _time_budget:
+    #       The number of seconds this SearchPlayer may spend on a move
+    #     _opponent_goals:
+    #       The goals of the other players in the game
+    #     _table:
+    #       The transposition table, mapping (encode_board of a board,
+    #       maximizing) to (depth searched, value, bound flag, best move)
+    #     _deadline:
+    #       The time.perf_counter() value at which the current search stops
+    #
+    # === Representation Invariants ===
+    #      _time_budget > 0
+    #      len(_table) <= TABLE_SIZE
+
+    # The maximum number of entries kept in the transposition table.
+    TABLE_SIZE = 50000
+
+    nodes_searched: int
+    search_time: float
+    depth_reached: int
+    _time_budget: float
+    _opponent_goals: List[Goal]
+    _table: 'OrderedDict[Tuple, Tuple[int, int, int, _Move]]'
+    _deadline: float
+
+    def __init__(self, renderer: Renderer, player_id: int, goal: Goal,
+                 time_budget: float) -> None:
+        """ Initializes an instance of class SearchPlayer, which may spend
+        <time_budget> seconds on each move.
+
+        === Precondition ===
+        time_budget > 0
+        """
+        Player.__init__(self, renderer, player_id, goal)
+        self._time_budget = time_budget
+        self._opponent_goals = []
+        self._table = OrderedDict()
+        self._deadline = 0.0
+        self.nodes_searched = 0
+        self.search_time = 0.0
+        self.depth_reached = 0
+
+    def set_opponents(self, goals: List[Goal]) -> None:
+        """ Sets the goals of the players this SearchPlayer plays against.
+        """
+        self._opponent_goals = goals
+
+    def nodes_per_second(self) -> float:
+        """ Returns the search speed of the last move, in positions per second.
+        """
+        if self.search_time == 0:
+            return 0.0
+        return self.nodes_searched / self.search_time
+
+    def make_move(self, board: Block) -> int:
+        """ Makes the best move found by SearchPlayer within its time budget.
+        """
+        start = time.perf_counter()
+        self._deadline = start + self._time_budget
+        self.nodes_searched = 0
+        self.depth_reached = 0
+        moves = _search_moves(board)
+        if moves == []:
+            self.search_time = time.perf_counter() - start
+            return 0
+
+        best = 0
+        order = list(range(len(moves)))
+        depth = 1
+        # The search undoes every move it tries, so record no deltas
+        with board.deltas_paused():
+            try:
+                while True:
+                    iteration_best = None
+                    iteration_score = _LOSS
+                    scores = {}
+                    for i in order:
+                        _move_smart(moves[i][0], moves[i][1])
+                        try:
+                            score = self._search(board, depth - 1, False,
+                                                 iteration_score, _WIN)
+                        finally:
+                            _move_smart(moves[i][0], _ANTIMOVES[moves[i][1]])
+                        scores[i] = score
+                        if iteration_best is None or score > iteration_score:
+                            iteration_best = i
+                            iteration_score = score
+                            # The previous best move is searched first, so a
+                            # better move found part way is safe to play.
+                            best = i
+                    self.depth_reached = depth
+                    # Search the most promising moves first next time.
+                    order.sort(key=lambda j: scores[j], reverse=True)
+                    depth += 1
+            except _SearchTimeout:
+                pass
+
+        moves[best][0].highlighted = True
+        _move_smart(moves[best][0], moves[best][1])
+        moves[best][0].highlighted = False
+        self.search_time = time.perf_counter() - start
+        return 0
+
+    def _search(self, board: Block, depth: int, maximizing: bool,
+                alpha: int, beta: int) -> int:
+        """ Returns the minimax value of <board> searched <depth> moves deep,
+        using an alpha-beta window of (<alpha>, <beta>).
+
+        <maximizing> is True iff it is this SearchPlayer's turn to move.
+        Raises _SearchTimeout once the deadline of the move has passed.
+        """
+        self.nodes_searched += 1
+        if time.perf_counter() >= self._deadline:
+            raise _SearchTimeout
+        if depth == 0:
+            return self._evaluate(board)
+
+        if self._opponent_goals == []:
+            # Nobody to play against, so every move is ours
+            maximizing = True
+        key = (encode_board(board), maximizing)
+        entry = self._table.get(key)
+        if entry is not None:
+            self._table.move_to_end(key)
+            # A value from a shallower search is no use, but its best move
+            # still goes first below.
+            if entry[0] >= depth:
+                value, flag = entry[1], entry[2]
+                if flag == _EXACT:
+                    return value
+                elif flag == _LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+
+        moves = _search_moves(board)
+        if moves == []:
+            return self._evaluate(board)
+        first = 0
+        if entry is not None:
+            # Try the best move of an earlier search of this position first
+            first = _move_index(board, moves, entry[3])
+        order = [first] + [i for i in range(len(moves)) if i != first]
+
+        original_alpha, original_beta = alpha, beta
+        best_index = first
+        best_value = _LOSS if maximizing else _WIN
+        for i in order:
+            _move_smart(moves[i][0], moves[i][1])
+            try:
+                value = self._search(board, depth - 1, not maximizing,
+                                     alpha, beta)
+            finally:
+                _move_smart(moves[i][0], _ANTIMOVES[moves[i][1]])
+            if maximizing and value > best_value:
+                best_value, best_index = value, i
+                alpha = max(alpha, value)
+            elif not maximizing and value < best_value:
+                best_value, best_index = value, i
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            flag = _UPPER
+        elif best_value >= original_beta:
+            flag = _LOWER
+        else:
+            flag = _EXACT
+        if entry is None or entry[0] <= depth:
+            best_block, best_move = moves[best_index]
+            self._table[key] = (depth, best_value, flag,
+                                (best_block.path(), best_move))
+        if len(self._table) > self.TABLE_SIZE:
+            # Forget the least recently used position
+            self._table.popitem(last=False)
+        return best_value
+
+    def _evaluate(self, board: Block) -> int:
+        """ Returns how good <board> is for this SearchPlayer: its own score
+        minus the best score among its opponents.
+        """
+        score = self.goal.score(board)
+        if self._opponent_goals == []:
+            return score
+        return score - max(goal.score(board) for goal in self._opponent_goals)
+
+
 def _random_move(block: Block) -> None:
     """ A helper function for RandomPlayer's make_move,
      which makes a random move on a given block
@@ -330,6 +702,33 @@ def _random_block(block: Block) -> Block:
         else:
             return block.children[quadrant]
 
+def _search_moves(board: Block) -> List[Tuple[Block, int]]:
+    """ A helper function for SearchPlayer, which returns every move which
+    can change <board>, as (block, move code) pairs in the format used by
+    _move_smart. Blocks are listed level by level from the board's
+    BlockIndex, so the order only changes when a block is smashed.
+    """
+    return [(block, move) for block in board.block_index().internal_blocks()
+            for move in range(4)]
+
+def _move_index(board: Block, moves: List[Tuple[Block, int]],
+                move: _Move) -> int:
+    """ A helper function for SearchPlayer, which returns the index in
+    <moves>, as returned by _search_moves(board), of <move>, given as the
+    path from <board> to the block moved and the move code.
+    """
+    block = board
+    for i in move[0]:
+        block = block.children[i]
+    for i in range(len(moves)):
+        if moves[i][0] is block and moves[i][1] == move[1]:
+            return i
+    return 0
+
+class _SearchTimeout(Exception):
+    """ Raised inside SearchPlayer's search once its time budget is used up.
+    """
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
@@ -337,7 +736,7 @@ if __name__ == '__main__':
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing',
             'block', 'goal', 'player', 'renderer',
-            'pygame'
+            'pygame', 'time', 'collections'
         ],
         'max-attributes': 10,
         'generated-members': 'pygame.*'
@@ -10,8 +10,12 @@ University of Toronto
 
 This file contains the Renderer class.
 """
-from typing import List, Tuple
-import pygame
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+# pygame is only imported once a Renderer is created, so that the model and
+# simulations (which use HeadlessRenderer) start without loading it.
+if TYPE_CHECKING:
+    import pygame
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -29,6 +33,14 @@ BOARD_WIDTH = 500
 BOARD_HEIGHT = 500
 TEXT_HEIGHT = 75
 
+# pygame resources shared by every Renderer in this process, so that games
+# played one after another do not load fonts, render text or open the
+# window again: fonts by (system font?, name, size), rendered text by font
+# and render arguments, and the display surface by window size.
+_FONTS = {}
+_TEXT = {}
+_DISPLAYS = {}
+
 
 def colour_name(colour: Tuple[int, int, int]) -> str:
     """Return the colour name associated with this colour value, or
@@ -40,6 +52,125 @@ def colour_name(colour: Tuple[int, int, int]) -> str:
     return ''
 
 
+def board_image(board: 'Block', size: int) -> 'pygame.Surface':
+    """Return an image of <board>, <size> pixels across, with every
+    undivided block filled with its colour and framed in BLACK, 3 pixels
+    thick.
+
+    The colours are taken from board.flatten, which is built from cached
+    rasters, as an image with one pixel per unit cell, and scaled up to
+    <size> in one step.  Only the frames are drawn block by block.
+    """
+    import pygame
+    grid = board.flatten()
+    width = len(grid)
+    colours = {}
+    for column in grid:
+        for colour in column:
+            if colour not in colours:
+                colours[colour] = bytes(colour)
+    pixels = b''.join([colours[colour] for row in zip(*grid)
+                       for colour in row])
+    image = pygame.transform.scale(
+        pygame.image.frombuffer(pixels, (width, width), 'RGB'), (size, size))
+    # The first pixel of each column (or row) of unit cells, as scaled
+    edges = [-(-c * size // width) for c in range(width + 1)]
+    _draw_frames(image, board, 0, 0, width, edges)
+    return image
+
+
+def _draw_frames(image: 'pygame.Surface', block: 'Block', x: int, y: int,
+                 width: int, edges: List[int]) -> None:
+    """Draw the frame of every undivided block within <block> on <image>,
+    for board_image.  <block> covers the <width> by <width> unit cells
+    starting at column <x> and row <y>, and <edges> holds the first pixel
+    of each column of unit cells.
+    """
+    import pygame
+    if block.children != []:
+        half = width // 2
+        _draw_frames(image, block.children[0], x + half, y, half, edges)
+        _draw_frames(image, block.children[1], x, y, half, edges)
+        _draw_frames(image, block.children[2], x, y + half, half, edges)
+        _draw_frames(image, block.children[3], x + half, y + half, half,
+                     edges)
+        return
+    pygame.draw.rect(image, BLACK,
+                     (edges[x], edges[y], edges[x + width] - edges[x],
+                      edges[y + width] - edges[y]), 3)
+
+
+def clear_resource_cache() -> None:
+    """Forget the fonts, rendered text and display surface shared by
+    Renderers, so that the next Renderer creates them again.
+    """
+    _FONTS.clear()
+    _TEXT.clear()
+    _DISPLAYS.clear()
+
+
+def _display(size: Tuple[int, int]) -> 'pygame.Surface':
+    """Return the display surface of a window of <size>, opening the window
+    only if it is not already open at that size.
+    """
+    import pygame
+    if not pygame.display.get_init() or not pygame.font.get_init():
+        # pygame was shut down, so nothing cached is usable any more
+        clear_resource_cache()
+        pygame.init()
+    surface = _DISPLAYS.get(size)
+    if surface is None or pygame.display.get_surface() is not surface:
+        _DISPLAYS.clear()
+        surface = pygame.display.set_mode(size)
+        _DISPLAYS[size] = surface
+    return surface
+
+
+def _font(name: Optional[str], size: int,
+          system: bool = True) -> 'pygame.font.Font':
+    """Return the font <name> at <size>, loading it the first time.
+
+    If <system> is True, the font is found with pygame.font.SysFont, and
+    otherwise loaded with pygame.font.Font.
+    """
+    import pygame
+    key = (system, name, size)
+    font = _FONTS.get(key)
+    if font is None:
+        if system:
+            font = pygame.font.SysFont(name, size)
+        else:
+            font = pygame.font.Font(name, size)
+        _FONTS[key] = font
+    return font
+
+
+def _text(font: 'pygame.font.Font', text: str,
+          colour: Tuple[int, int, int],
+          background: Optional[Tuple[int, int, int]] = None) \
+        -> 'pygame.Surface':
+    """Return <text> rendered antialiased with <font> in <colour>, on
+    <background> if it is given, rendering it the first time.
+
+    The surface returned is shared, and must not be drawn on.
+    """
+    key = (id(font), text, colour, background)
+    surface = _TEXT.get(key)
+    if surface is None:
+        surface = font.render(text, True, colour, background)
+        _TEXT[key] = surface
+    return surface
+
+
+def _highlighted_blocks(block: 'Block') -> List['Block']:
+    """Return every highlighted Block within <block>, including itself.
+    """
+    highlighted = [block] if block.highlighted else []
+    for child in block.children:
+        highlighted.extend(_highlighted_blocks(child))
+    return highlighted
+
+
 class Renderer:
     """
     A class designed to handle the drawing and context for the board
@@ -52,30 +183,49 @@ class Renderer:
          The height and width of the rendering window, in pixels.
     player_labels:
          list of player icons to display
+    blit_board:
+         True if the board is drawn as one image built by board_image,
+         and False if each rectangle from rectangles_to_draw is drawn
+         separately
     """
-    displayed_image: pygame.Surface
-    screen: pygame.Surface
+    displayed_image: 'pygame.Surface'
+    screen: 'pygame.Surface'
     window_size: Tuple[int, int]
-    player_labels: List[pygame.Surface]
+    player_labels: List['pygame.Surface']
+    blit_board: bool
+    # === Private Attributes ===
+    # _board_image:
+    #     The image of the board most recently drawn with blit_board, or None
+    # _board_image_key:
+    #     The board, version and size that _board_image shows
+    _board_image: Optional['pygame.Surface']
+    _board_image_key: Optional[Tuple['Block', int, int]]
 
-    def __init__(self, num_players: int) -> None:
+    def __init__(self, num_players: int, blit_board: bool = True) -> None:
         """Initialize this renderer.
 
         <num_players> is the total number of players in this Game.  It is
         used to render a label showing the player whose move it is at any
         given time.
+
+        If <blit_board> is True, the board is drawn as one image, which is
+        only rebuilt after the board changes, so redrawing a board whose
+        highlighted blocks are all that changed costs a single blit.
         """
-        pygame.init()
-        self.displayed_image = \
-            pygame.display.set_mode((BOARD_WIDTH, BOARD_HEIGHT + 75))
+        self.blit_board = blit_board
+        self._board_image = None
+        self._board_image_key = None
+        # The window, font and rendered text are shared with every other
+        # Renderer, so only the first one in a process creates them.
+        self.displayed_image = _display((BOARD_WIDTH, BOARD_HEIGHT + 75))
         self.screen = \
             self.displayed_image.subsurface(((0, 0),
                                              (BOARD_WIDTH, BOARD_HEIGHT)))
         self.screen.fill(WHITE)
 
-        font = pygame.font.SysFont(None, 25)
+        font = _font(None, 25)
         self.player_labels = [
-            font.render(f'PLAYER {i}', True, MELON_MAMBO, (0, 0, 0))
+            _text(font, f'PLAYER {i}', MELON_MAMBO, (0, 0, 0))
             for i in range(num_players)
         ]
 
@@ -84,37 +234,41 @@ class Renderer:
 
     def _render_text_help(self):
         """Add the UI text onto the display."""
-        font = pygame.font.SysFont(None, 25)
+        font = _font(None, 25)
         self.displayed_image.blit(
-            font.render("LMB: rotate CW           " +
-                        "RMB: rotate CCW         ",
-                        True,
-                        (255, 255, 255)), (0, BOARD_HEIGHT + 25)
+            _text(font,
+                  "LMB: rotate CW           " +
+                  "RMB: rotate CCW         ",
+                  (255, 255, 255)), (0, BOARD_HEIGHT + 25)
         )
         self.displayed_image.blit(
-            font.render("H: Swap Horizontally     " +
-                        "V: Swap Vertically     " +
-                        "S: Smash Cell     " +
-                        "Up/Down: Change selection",
-                        True,
-                        (255, 255, 255)), (0, BOARD_HEIGHT + 50)
+            _text(font,
+                  "H: Swap Horizontally     " +
+                  "V: Swap Vertically     " +
+                  "S: Smash Cell     " +
+                  "Up/Down: Change selection",
+                  (255, 255, 255)), (0, BOARD_HEIGHT + 50)
         )
 
     def draw(self, board: 'Block', player_id: int) -> None:
         """Clear the canvas and draw the blocks."""
+        import pygame
         # draw the background map onto the screen
         self.screen.fill(WHITE)
 
-        selected = []
-        for colour, pos, size, width in board.rectangles_to_draw():
-            if colour == TEMPTING_TURQUOISE:
-                selected.append((colour, pos, size, width))
-            else:
-                pygame.draw.rect(self.screen, colour, (pos, size), width)
+        if self.blit_board:
+            self._blit_board(board)
+        else:
+            selected = []
+            for colour, pos, size, width in board.rectangles_to_draw():
+                if colour == TEMPTING_TURQUOISE:
+                    selected.append((colour, pos, size, width))
+                else:
+                    pygame.draw.rect(self.screen, colour, (pos, size), width)
 
-        # Draw highlighted rectangle borders last
-        for colour, x, y, width in selected:
-            pygame.draw.rect(self.screen, colour, (x, y), width)
+            # Draw highlighted rectangle borders last
+            for colour, x, y, width in selected:
+                pygame.draw.rect(self.screen, colour, (x, y), width)
 
         self.displayed_image.blit(
             self.player_labels[player_id], (0, BOARD_HEIGHT))
@@ -124,6 +278,25 @@ class Renderer:
         # updating of the pygame window.
         pygame.event.peek([])
 
+    def _blit_board(self, board: 'Block') -> None:
+        """Draw <board> onto the screen as a single image, then draw the
+        frames of its highlighted blocks on top.
+
+        The image is only rebuilt when the board has changed since it was
+        last drawn.
+        """
+        import pygame
+        size = int(board.size)
+        key = (board, board.version, size)
+        if self._board_image is None or self._board_image_key != key:
+            self._board_image = board_image(board, size)
+            self._board_image_key = key
+        self.screen.blit(self._board_image, board.position)
+
+        for block in _highlighted_blocks(board):
+            pygame.draw.rect(self.screen, TEMPTING_TURQUOISE,
+                             (block.position, (block.size, block.size)), 5)
+
     # For game start
     def display_goal(self, player: 'Player') -> None:
         """Display the goal for the given player.
@@ -138,9 +311,10 @@ class Renderer:
         Modified from
         http://archives.seul.org/pygame/users/May-2005/msg00008.html.
         """
+        import pygame
         screen = self.screen
         screen.fill(colour)
-        font = pygame.font.Font(None, 18)
+        font = _font(None, 18, system=False)
         rect = pygame.Rect([0, 0, 400, 22])
         rect.center = screen.get_rect().center
 
@@ -152,7 +326,7 @@ class Renderer:
         rect.top += offset[1]
 
         if len(message) > 0:
-            screen.blit(font.render(message, 1, WHITE), rect.topleft)
+            screen.blit(_text(font, message, WHITE), rect.topleft)
 
         pygame.display.flip()
 
@@ -163,6 +337,26 @@ class Renderer:
                 if e.type == pygame.MOUSEBUTTONDOWN:
                     return
 
+class HeadlessRenderer(Renderer):
+    """A renderer which draws nothing, for games played without a window,
+    such as simulations and games hosted by a server.
+
+    It never initializes pygame, and all of its methods do nothing.
+    """
+
+    def __init__(self, num_players: int) -> None:
+        """Initialize this renderer for a Game with <num_players> players.
+        """
+        self.player_labels = []
+
+    def draw(self, board: 'Block', player_id: int) -> None:
+        """Draw nothing."""
+
+    def display_goal(self, player: 'Player') -> None:
+        """Display nothing.
+        """
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
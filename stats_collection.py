@@ -1,14 +1,35 @@
 """Not for assignment: collecting stats on the winners of games"""
 
-from typing import List
+import json
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import product
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, \
+    Tuple
 import game_stats
+from block import game_rng
+from goal import BlobGoal, PerimeterGoal
+from renderer import HeadlessRenderer
 
-def collect_stats (size: int, diff_1: int, diff_2: int) -> int:
-    """Returns the number of wins of the first player"""
+# The goal types a sweep can ask for, by name.  'random' gives every game
+# a goal type at random, as Game does by default.
+GOAL_TYPES = {'random': None, 'blob': BlobGoal, 'perimeter': PerimeterGoal}
+
+
+def collect_stats (size: int, diff_1: int, diff_2: int,
+                   aggregator: Optional['GameAggregator'] = None) -> int:
+    """Returns the number of wins of the first player
+
+    If <aggregator> is given, every game is also recorded in it.
+    """
     wins = 0
     for _ in range(size):
-        new_game = game_stats.Game(3, 0, 0, [diff_1, diff_2])
-        winner = new_game.run_game(10)
+        new_game = game_stats.Game(3, 0, 0, [diff_1, diff_2],
+                                   renderer=HeadlessRenderer(2))
+        winner = new_game.run_game(10, aggregator)
         if winner == 0:
             wins += 1
     return wins
@@ -18,5 +39,491 @@ def list_of_wins() -> List[int]:
            collect_stats(1000, 2, 5), collect_stats(1000, 3, 5),
            collect_stats(1000, 4, 5), collect_stats(1000, 5, 5)]
 
+
+class RunningStats:
+    """The count, mean and variance of a stream of integers, kept in
+    constant memory.
+
+    The sums are kept as exact integers, so merging the RunningStats of
+    several parts of a stream gives exactly the RunningStats of the whole.
+
+    === Attributes ===
+    count:
+        The number of values added.
+    total:
+        The sum of the values added.
+    total_squares:
+        The sum of the squares of the values added.
+    """
+    count: int
+    total: int
+    total_squares: int
+
+    def __init__(self) -> None:
+        """Initialize these stats of an empty stream.
+        """
+        self.count = 0
+        self.total = 0
+        self.total_squares = 0
+
+    def add(self, value: int) -> None:
+        """Add <value> to the stream.
+        """
+        self.count += 1
+        self.total += value
+        self.total_squares += value * value
+
+    def merge(self, other: 'RunningStats') -> None:
+        """Add every value of the stream summarized by <other>.
+        """
+        self.count += other.count
+        self.total += other.total
+        self.total_squares += other.total_squares
+
+    def mean(self) -> float:
+        """Return the mean of the values added, or 0 if there are none.
+        """
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def variance(self) -> float:
+        """Return the sample variance of the values added, or 0 if there
+        are fewer than two.
+        """
+        if self.count < 2:
+            return 0.0
+        return (self.count * self.total_squares - self.total ** 2) / \
+            (self.count * (self.count - 1))
+
+    def standard_error(self) -> float:
+        """Return the standard error of the mean of the values added, or 0
+        if there are fewer than two.
+        """
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.variance() / self.count)
+
+
+class Histogram:
+    """Counts of a stream of numbers in fixed-width bins.
+
+    === Attributes ===
+    low:
+        The smallest value of the first bin.
+    width:
+        The width of each bin.
+    counts:
+        The number of values in each bin.  Bin i holds the values v with
+        low + i * width <= v < low + (i + 1) * width.
+    under:
+        The number of values below the first bin.
+    over:
+        The number of values above the last bin.
+    """
+    low: float
+    width: float
+    counts: List[int]
+    under: int
+    over: int
+
+    def __init__(self, low: float, high: float, num_bins: int) -> None:
+        """Initialize an empty histogram of <num_bins> bins covering the
+        values from <low> up to <high>.
+        """
+        self.low = low
+        self.width = (high - low) / num_bins
+        self.counts = [0] * num_bins
+        self.under = 0
+        self.over = 0
+
+    def add(self, value: float) -> None:
+        """Count <value> in its bin.
+        """
+        if value < self.low:
+            self.under += 1
+            return
+        i = int((value - self.low) // self.width)
+        if i >= len(self.counts):
+            self.over += 1
+        else:
+            self.counts[i] += 1
+
+    def merge(self, other: 'Histogram') -> None:
+        """Add the counts of <other>, which has the same bins as this
+        histogram.
+        """
+        for i in range(len(self.counts)):
+            self.counts[i] += other.counts[i]
+        self.under += other.under
+        self.over += other.over
+
+
+class GameAggregator:
+    """Statistics of any number of games, kept in constant memory.
+
+    Pass a GameAggregator to Game.run_game or collect_stats to record games
+    in it.  GameAggregators of games played in different processes can be
+    combined with merge, giving exactly the statistics of all the games.
+
+    === Attributes ===
+    games:
+        The number of games recorded.
+    wins:
+        For each goal type name, the number of games each seat has won with
+        that goal type (seat i being self.players[i] in the Game).
+    games_by_goal:
+        The number of games recorded for each goal type name.
+    scores:
+        The final scores of all players in all games.
+    score_histogram:
+        The final scores of all players in all games.
+    margins:
+        The difference between the highest and second highest final score
+        in each game.
+    margin_histogram:
+        The margins of all games.
+    trajectories:
+        For each move of a game, counting from 0, the scores of each seat
+        just after that move.
+    """
+    games: int
+    wins: Dict[str, List[int]]
+    games_by_goal: Dict[str, int]
+    scores: RunningStats
+    score_histogram: Histogram
+    margins: RunningStats
+    margin_histogram: Histogram
+    trajectories: List[List[RunningStats]]
+
+    def __init__(self, max_score: int, num_bins: int = 64) -> None:
+        """Initialize an empty aggregator, with histograms of <num_bins>
+        bins covering scores and margins from 0 to at least <max_score>.
+        Scores are whole numbers, so every bin is a whole number of points
+        wide and holds the same number of possible scores.
+
+        On a board of max_depth d, no score is greater than 4 ** d.
+        """
+        width = math.ceil((max_score + 1) / num_bins)
+        self.games = 0
+        self.wins = {}
+        self.games_by_goal = {}
+        self.scores = RunningStats()
+        self.score_histogram = Histogram(0, width * num_bins, num_bins)
+        self.margins = RunningStats()
+        self.margin_histogram = Histogram(0, width * num_bins, num_bins)
+        self.trajectories = []
+
+    def record_turn(self, turn: int, scores: List[int]) -> None:
+        """Record the <scores> of each seat just after move <turn>.
+        """
+        while len(self.trajectories) <= turn:
+            self.trajectories.append([])
+        seats = self.trajectories[turn]
+        while len(seats) < len(scores):
+            seats.append(RunningStats())
+        for seat, score in zip(seats, scores):
+            seat.add(score)
+
+    def record_game(self, goal_name: str, scores: List[int],
+                    winner: int) -> None:
+        """Record a game with goals of type <goal_name>, which ended with
+        the given <scores> for each seat and was won by seat <winner>.
+        """
+        self.games += 1
+        self.games_by_goal[goal_name] = \
+            self.games_by_goal.get(goal_name, 0) + 1
+        wins = self.wins.setdefault(goal_name, [])
+        while len(wins) < len(scores):
+            wins.append(0)
+        wins[winner] += 1
+        for score in scores:
+            self.scores.add(score)
+            self.score_histogram.add(score)
+        ranked = sorted(scores, reverse=True)
+        margin = ranked[0] - ranked[1] if len(ranked) > 1 else ranked[0]
+        self.margins.add(margin)
+        self.margin_histogram.add(margin)
+
+    def win_rates(self, goal_name: str) -> List[float]:
+        """Return the fraction of games with goals of type <goal_name> which
+        each seat won.
+        """
+        games = self.games_by_goal.get(goal_name, 0)
+        if games == 0:
+            return []
+        return [wins / games for wins in self.wins[goal_name]]
+
+    def merge(self, other: 'GameAggregator') -> None:
+        """Add every game recorded in <other>, which has the same histogram
+        bins as this aggregator.
+        """
+        self.games += other.games
+        for goal_name, games in other.games_by_goal.items():
+            self.games_by_goal[goal_name] = \
+                self.games_by_goal.get(goal_name, 0) + games
+        for goal_name, other_wins in other.wins.items():
+            wins = self.wins.setdefault(goal_name, [])
+            while len(wins) < len(other_wins):
+                wins.append(0)
+            for seat, count in enumerate(other_wins):
+                wins[seat] += count
+        self.scores.merge(other.scores)
+        self.score_histogram.merge(other.score_histogram)
+        self.margins.merge(other.margins)
+        self.margin_histogram.merge(other.margin_histogram)
+        for turn, other_seats in enumerate(other.trajectories):
+            while len(self.trajectories) <= turn:
+                self.trajectories.append([])
+            seats = self.trajectories[turn]
+            while len(seats) < len(other_seats):
+                seats.append(RunningStats())
+            for seat, stats in zip(seats, other_seats):
+                seat.merge(stats)
+
+
+class SweepCell(NamedTuple):
+    """One configuration of games in a parameter sweep.
+
+    === Attributes ===
+    max_depth:
+        The max_depth of the board.
+    num_turns:
+        The number of turns each player gets.
+    random_players:
+        The number of random players, who play first.
+    smart_players:
+        The difficulty of each smart player, in the order they play.
+    goal_type:
+        A key of GOAL_TYPES.
+    """
+    max_depth: int
+    num_turns: int
+    random_players: int
+    smart_players: Tuple[int, ...]
+    goal_type: str
+
+    def key(self) -> str:
+        """Return the key of this cell's results in a sweep cache.
+        """
+        return json.dumps(list(self))
+
+
+def sweep_grid(max_depths: Iterable[int], num_turns: Iterable[int],
+               lineups: Iterable[Tuple[int, Tuple[int, ...]]],
+               goal_types: Iterable[str]) -> List[SweepCell]:
+    """Return every combination of the given values as a SweepCell.
+
+    Each lineup is a pair of the number of random players and the
+    difficulties of the smart players.
+    """
+    return [SweepCell(depth, turns, lineup[0], tuple(lineup[1]), goal_type)
+            for depth, turns, lineup, goal_type
+            in product(max_depths, num_turns, lineups, goal_types)]
+
+
+def play_sweep_game(cell: SweepCell, seed: int) -> int:
+    """Play the game of <cell> with the given <seed>, and return the index
+    of the winner.
+
+    The seed fixes the board, the goal colours, and the moves of the random
+    and smart players, so a cell's game for a seed is always the same, and
+    cells which only differ in the players share boards and colours.  The
+    state of the random module is restored afterwards.
+    """
+    num_players = cell.random_players + len(cell.smart_players)
+    with _seeded_random(seed):
+        game = game_stats.Game(cell.max_depth, 0, cell.random_players,
+                               list(cell.smart_players),
+                               rng=game_rng(seed, 0),
+                               renderer=HeadlessRenderer(num_players),
+                               goal_type=GOAL_TYPES[cell.goal_type])
+        return game.run_game(cell.num_turns)
+
+
+@contextmanager
+def _seeded_random(seed: int) -> Iterator[None]:
+    """Within the with statement, seed the random module, which players and
+    smashes draw from, with <seed>.  Its state is restored afterwards, so
+    the caller's random numbers are not disturbed.
+    """
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        yield
+    finally:
+        random.setstate(state)
+
+
+def _play_sweep_task(task: Tuple[SweepCell, int]) -> int:
+    """Play the game of a (cell, seed) pair, for a process pool.
+    """
+    return play_sweep_game(*task)
+
+
+def run_sweep(cells: Iterable[SweepCell], seeds: Iterable[int],
+              cache_path: Optional[str] = None,
+              workers: int = 1) -> Dict[SweepCell, List[int]]:
+    """Play the game of every cell in <cells> for every seed in <seeds>,
+    and return the number of wins of each player in each cell.
+
+    If <cache_path> is given, the winner of every game played is cached in
+    the JSON file there, by cell and seed, and cached games are not played
+    again.  Widening a sweep to new cells or seeds therefore only plays the
+    new games.  With <workers> greater than 1, the games are spread over
+    that many processes.
+    """
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    cells = list(cells)
+    seeds = list(seeds)
+
+    tasks = [(cell, seed) for cell in cells for seed in seeds
+             if str(seed) not in cache.get(cell.key(), {})]
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            winners = list(executor.map(_play_sweep_task, tasks,
+                                        chunksize=16))
+    else:
+        winners = [_play_sweep_task(task) for task in tasks]
+    for (cell, seed), winner in zip(tasks, winners):
+        cache.setdefault(cell.key(), {})[str(seed)] = winner
+
+    if cache_path is not None and tasks != []:
+        # Replace the old cache in one step, so it is never left half written
+        with open(cache_path + '.tmp', 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(cache_path + '.tmp', cache_path)
+
+    results = {}
+    for cell in cells:
+        wins = [0] * (cell.random_players + len(cell.smart_players))
+        for seed in seeds:
+            wins[cache[cell.key()][str(seed)]] += 1
+        results[cell] = wins
+    return results
+
+
+class PairedComparison:
+    """A comparison of two smart player difficulties using common random
+    numbers: for each seed, both difficulties play the same board, goal
+    type and colours twice, once from each seat, and the results are kept
+    as differences between the two.
+
+    Luck of the board, goals and seats affects both difficulties alike,
+    so it cancels out of the differences, which vary far less than the
+    results of independent games.
+
+    === Attributes ===
+    difficulties:
+        The two difficulties compared, a and b.
+    win_differences:
+        For each seed, the number of its two games won by a minus the
+        number won by b.
+    score_differences:
+        For each seed, a's final score minus b's, summed over its two games.
+    """
+    difficulties: Tuple[int, int]
+    win_differences: RunningStats
+    score_differences: RunningStats
+
+    def __init__(self, difficulty_a: int, difficulty_b: int) -> None:
+        """Initialize an empty comparison of <difficulty_a> against
+        <difficulty_b>.
+        """
+        self.difficulties = (difficulty_a, difficulty_b)
+        self.win_differences = RunningStats()
+        self.score_differences = RunningStats()
+
+    def add(self, win_difference: int, score_difference: int) -> None:
+        """Add the differences of one seed, as returned by play_paired_seed.
+        """
+        self.win_differences.add(win_difference)
+        self.score_differences.add(score_difference)
+
+    def win_rate(self) -> float:
+        """Return the fraction of games won by a.
+        """
+        return 0.5 + self.win_differences.mean() / 4
+
+    def win_rate_interval(self, z: float = 1.96) -> Tuple[float, float]:
+        """Return the confidence interval of a's win rate, <z> standard
+        errors either side of it (95% for the default).
+        """
+        error = z * self.win_differences.standard_error() / 4
+        return self.win_rate() - error, self.win_rate() + error
+
+
+def play_paired_seed(difficulty_a: int, difficulty_b: int, seed: int,
+                     max_depth: int = 3, num_turns: int = 10) \
+        -> Tuple[int, int]:
+    """Play the game of <seed> between smart players of <difficulty_a> and
+    <difficulty_b> twice, with a in the first seat and then in the second,
+    and return the number of games won by a minus the number won by b, and
+    a's final scores minus b's, summed over both games.
+
+    The seed fixes the board, the goal type and the colour of each seat
+    (through game_rng), and the smart players' random choices (through the
+    random module), so the only change between the games is who sits where.
+    The state of the random module is restored afterwards.
+    """
+    win_difference = 0
+    score_difference = 0
+    for seat_a in (0, 1):
+        difficulties = [difficulty_a, difficulty_b]
+        if seat_a == 1:
+            difficulties.reverse()
+        with _seeded_random(seed):
+            game = game_stats.Game(max_depth, 0, 0, difficulties,
+                                   rng=game_rng(seed, 0),
+                                   renderer=HeadlessRenderer(2))
+            winner = game.run_game(num_turns)
+        scores = game.scores()
+        win_difference += 1 if winner == seat_a else -1
+        score_difference += scores[seat_a] - scores[1 - seat_a]
+    return win_difference, score_difference
+
+
+def _play_paired_task(task: Tuple[int, int, int, int, int]) \
+        -> Tuple[int, int]:
+    """Play the games of a seed for paired_comparison, for a process pool.
+    """
+    return play_paired_seed(*task)
+
+
+def paired_comparison(difficulty_a: int, difficulty_b: int,
+                      seeds: Iterable[int], max_depth: int = 3,
+                      num_turns: int = 10,
+                      workers: int = 1) -> PairedComparison:
+    """Return the PairedComparison of smart players of <difficulty_a> and
+    <difficulty_b> over the given <seeds>, playing two games per seed, on
+    boards of <max_depth> with <num_turns> turns each.
+
+    With <workers> greater than 1, the seeds are spread over that many
+    processes.
+    """
+    tasks = [(difficulty_a, difficulty_b, seed, max_depth, num_turns)
+             for seed in seeds]
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(_play_paired_task, tasks,
+                                        chunksize=16))
+    else:
+        results = [_play_paired_task(task) for task in tasks]
+    comparison = PairedComparison(difficulty_a, difficulty_b)
+    for win_difference, score_difference in results:
+        comparison.add(win_difference, score_difference)
+    return comparison
+
+
+def paired_list_of_wins(num_seeds: int = 100) -> List[PairedComparison]:
+    """Return the paired comparison of each difficulty from 0 to 5 against
+    difficulty 5, as list_of_wins compares them, over <num_seeds> seeds.
+    """
+    return [paired_comparison(difficulty, 5, range(num_seeds))
+            for difficulty in range(6)]
+
 if __name__ == '__main__':
     print(list_of_wins())